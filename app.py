@@ -7,18 +7,130 @@
 # in two separate columns
 # handle sign out
 
+import csv
+import hashlib
+import io
 import os
-from flask import Flask, render_template, request, redirect, url_for, session
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+from functools import cache, wraps
+import click
+from flask import (Blueprint, Flask, abort, current_app, flash, g, get_template_attribute,
+                   has_request_context, jsonify, make_response, render_template, request, redirect,
+                   url_for, session)
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import (DDL, Integer, String, and_, bindparam, column, delete, desc, event, func, insert,
+                        inspect, literal, literal_column, or_, select, text, tuple_, update, values)
+from sqlalchemy.orm import aliased, joinedload
+from sqlalchemy.exc import IntegrityError, OperationalError
 from flask_admin import Admin, expose, AdminIndexView
+from flask_admin.actions import action
 from flask_admin.contrib.sqla import ModelView
-# create a new sql database uri 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///school.db'
-app.secret_key = os.urandom(24)
-
-# initialize database
-db = SQLAlchemy(app)
+from flask_admin.contrib.sqla.filters import FilterEqual, IntEqualFilter, IntInListFilter
+from flask_admin.tools import iterdecode
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import is_resource_modified
+import exports
+import instrumentation
+import schedule
+# configuration comes from the environment so every worker process of a
+# deployment agrees on the database and the session secret
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+def load_config():
+    return {
+        'SQLALCHEMY_DATABASE_URI': os.environ.get('DATABASE_URL', 'sqlite:///school.db'),
+        # archived terms; by default a second SQLite file next to the main one
+        'ARCHIVE_DATABASE_URL': os.environ.get('ARCHIVE_DATABASE_URL'),
+        # every worker must sign sessions with the same key; without
+        # SECRET_KEY one is generated once and kept in SECRET_KEY_FILE
+        'SECRET_KEY': os.environ.get('SECRET_KEY'),
+        'SECRET_KEY_FILE': os.environ.get('SECRET_KEY_FILE'),
+        'DB_POOL_SIZE': env_int('DB_POOL_SIZE', 5),
+        'DB_MAX_OVERFLOW': env_int('DB_MAX_OVERFLOW', 10),
+        'DB_POOL_RECYCLE': env_int('DB_POOL_RECYCLE', 3600),
+        # many students enroll at once when registration opens: let readers
+        # run alongside the writer and wait on the write lock instead of failing
+        'SQLITE_JOURNAL_MODE': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'SQLITE_SYNCHRONOUS': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'SQLITE_MMAP_SIZE': env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'SQLITE_BUSY_TIMEOUT_MS': env_int('SQLITE_BUSY_TIMEOUT_MS', 5000),
+        # 'sync' applies enroll/unenroll in the request, 'queued' hands them to
+        # the registration worker pool and returns a ticket
+        'REGISTRATION_MODE': os.environ.get('REGISTRATION_MODE', 'sync'),
+        'REGISTRATION_WORKERS': env_int('REGISTRATION_WORKERS', 2),
+        'REGISTRATION_BATCH_SIZE': env_int('REGISTRATION_BATCH_SIZE', 100),
+    }
+
+def shared_secret(path):
+    # the first process to get here writes the key, the rest read it
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}'
+    with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+        f.write(os.urandom(32))
+    try:
+        os.link(tmp, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp)
+    with open(path, 'rb') as f:
+        return f.read()
+
+def is_memory_database(uri):
+    return uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in uri
+
+def archive_database_uri(uri):
+    # school.db -> school-archive.db; other databases keep the archive
+    # tables alongside the hot ones
+    if is_memory_database(uri):
+        return 'sqlite://'
+    if not uri.startswith('sqlite:///'):
+        return uri
+    root, ext = os.path.splitext(uri)
+    return f'{root}-archive{ext or ".db"}'
+
+def engine_options(config):
+    if is_memory_database(config['SQLALCHEMY_DATABASE_URI']):
+        # Flask-SQLAlchemy gives in-memory SQLite a single static connection
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+def sqlite_pragmas(config):
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA journal_mode={config["SQLITE_JOURNAL_MODE"]}')
+        cursor.execute(f'PRAGMA synchronous={config["SQLITE_SYNCHRONOUS"]}')
+        cursor.execute(f'PRAGMA mmap_size={int(config["SQLITE_MMAP_SIZE"])}')
+        cursor.execute(f'PRAGMA busy_timeout={int(config["SQLITE_BUSY_TIMEOUT_MS"])}')
+        cursor.close()
+    return set_sqlite_pragmas
+
+# initialize database; bound to an app in create_app
+db = SQLAlchemy()
+
+# every page and CLI command lives on this blueprint; the commands are
+# registered at the top level (flask upgrade-db, not flask main upgrade-db)
+bp = Blueprint('main', __name__, cli_group=None)
 
 # define user model
 class User(db.Model):
@@ -26,6 +138,8 @@ class User(db.Model):
     uni_id = db.Column(db.String(80), unique=True, nullable=False)
     password = db.Column(db.String(80), nullable=False)
     role = db.Column(db.String(20), nullable=False)  # "student", "teacher", "admin"
+    # bumped when an admin edits the account, which signs out its sessions
+    session_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     student_classes = db.relationship('Enrollment', backref='student', lazy=True, passive_deletes=True)
     teacher_classes = db.relationship('TeacherClass', backref='teacher', lazy=True, passive_deletes=True)
@@ -33,11 +147,39 @@ class User(db.Model):
     def __repr__(self):
         return f'<User {self.uni_id}>'
 
+# academic terms: every class belongs to one, and the pages work on the
+# active term. Exactly one term is active; a closed term keeps its
+# enrollments in the hot tables until it is archived.
+DEFAULT_TERM_ID = 1  # created with the table, holds classes from before terms
+
+class Term(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='active')  # "active", "closed", "archived"
+
+    classes = db.relationship('Class', backref='term', lazy=True)
+
+    __table_args__ = (
+        db.Index('ix_term_active', 'status', unique=True, sqlite_where=text("status = 'active'")),
+    )
+
+    def __repr__(self):
+        return f'<Term {self.name}>'
+
+event.listen(Term.__table__, 'after_create', DDL(
+    f"INSERT INTO term (id, name, status) VALUES ({DEFAULT_TERM_ID}, 'Current term', 'active')"))
+
+def active_term_default(context):
+    # new classes, ORM or Core, go into the active term
+    return context.connection.scalar(select(Term.id).where(Term.status == 'active'))
+
 # define class model
 class Class(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=True)
+    term_id = db.Column(db.Integer, db.ForeignKey('term.id'), nullable=False, default=active_term_default,
+                        index=True)
 
     students = db.relationship('Enrollment', backref='class_', lazy=True)
     teachers = db.relationship('TeacherClass', backref='class_', lazy=True)
@@ -51,6 +193,12 @@ class Enrollment(db.Model):
     class_id = db.Column(db.Integer, db.ForeignKey('class.id'), primary_key=True)
     grade = db.Column(db.Float, nullable=True)
 
+    __table_args__ = (
+        # rosters, seat counts and a class's min/max grade read the index
+        # alone instead of scanning the table, which is keyed by student
+        db.Index('ix_enrollment_class', 'class_id', 'student_id', 'grade'),
+    )
+
     def __repr__(self):
         return f'<Enrollment Student:{self.student_id} Class:{self.class_id}>'
 
@@ -61,48 +209,1648 @@ class TeacherClass(db.Model):
     day = db.Column(db.String(50), nullable=False)
     time = db.Column(db.String(50), nullable=False)
     max_seats = db.Column(db.Integer, nullable=False)
+    # parsed from day/time, NULL when the text can't be parsed
+    days_mask = db.Column(db.Integer, nullable=True)  # bit 0 = Monday ... bit 6 = Sunday
+    start_minute = db.Column(db.Integer, nullable=True)
+    end_minute = db.Column(db.Integer, nullable=True)
+
+    __table_args__ = (
+        # a class's sections and its first teacher's seat limit
+        db.Index('ix_teacher_class_class', 'class_id', 'teacher_id', 'max_seats'),
+    )
 
     def __repr__(self):
         return f'<TeacherClass Teacher:{self.teacher_id} Class:{self.class_id}>'
 
+# queued registration: enroll/unenroll requests waiting for a worker,
+# applied in id (arrival) order
+class RegistrationRequest(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    class_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(10), nullable=False)  # "enroll", "unenroll"
+    status = db.Column(db.String(10), nullable=False, default='pending')  # "pending", "done"
+    result = db.Column(db.String(20), nullable=True)
+    claimed_by = db.Column(db.String(40), nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_registration_request_pending', 'status', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<RegistrationRequest {self.id} {self.action} Student:{self.student_id} Class:{self.class_id}>'
+
+# waitlist for full classes, first come first served by id
+class Waitlist(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    class_id = db.Column(db.Integer, db.ForeignKey('class.id'), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'class_id'),
+        # queue order and positions within a class come off this index
+        db.Index('ix_waitlist_class_order', 'class_id', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<Waitlist Student:{self.student_id} Class:{self.class_id}>'
+
+# closed terms' enrollments and sections, moved out of the hot tables
+# into the archive database by archive_term; class and teacher names are
+# copied along so transcripts read them without the live tables
+class ArchivedEnrollment(db.Model):
+    __bind_key__ = 'archive'
+    # transcripts read one student's rows, so the key starts there
+    student_id = db.Column(db.Integer, primary_key=True)
+    term_id = db.Column(db.Integer, primary_key=True)
+    class_id = db.Column(db.Integer, primary_key=True)
+    class_name = db.Column(db.String(100), nullable=False)
+    grade = db.Column(db.Float, nullable=True)
+    grade_points = db.Column(db.Float, nullable=True)
+    class_average = db.Column(db.Float, nullable=True)
+
+    def __repr__(self):
+        return f'<ArchivedEnrollment Student:{self.student_id} Class:{self.class_id} Term:{self.term_id}>'
+
+class ArchivedSection(db.Model):
+    __bind_key__ = 'archive'
+    term_id = db.Column(db.Integer, primary_key=True)
+    class_id = db.Column(db.Integer, primary_key=True)
+    teacher_id = db.Column(db.Integer, primary_key=True)
+    teacher_name = db.Column(db.String(80), nullable=True)
+    day = db.Column(db.String(50), nullable=False)
+    time = db.Column(db.String(50), nullable=False)
+    max_seats = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<ArchivedSection Teacher:{self.teacher_id} Class:{self.class_id} Term:{self.term_id}>'
+
+def active_term():
+    # id of the active term, as a scalar subquery
+    return select(Term.id).where(Term.status == 'active').scalar_subquery()
+
+def in_term(class_id, term_id=None):
+    # true for a class (column or value) of the term, the active one by default
+    # aliased so it doesn't correlate with a Class the outer query joins
+    term = active_term() if term_id is None else term_id
+    scoped = aliased(Class)
+    return select(scoped.id).where(scoped.id == class_id, scoped.term_id == term).exists()
+
+@event.listens_for(TeacherClass, 'before_insert')
+@event.listens_for(TeacherClass, 'before_update')
+def set_meeting_slots(mapper, connection, target):
+    meeting = schedule.parse_meeting(target.day, target.time)
+    target.days_mask, target.start_minute, target.end_minute = meeting or (None, None, None)
+
+MEETING_COLUMNS = ('days_mask', 'start_minute', 'end_minute')
+
+def migrate_meeting_times(reparse=False):
+    # databases created before the structured columns get them added,
+    # and any row without them (every row with reparse) is parsed from
+    # its day/time text
+    existing = {column['name'] for column in inspect(db.engine).get_columns('teacher_class')}
+    with db.engine.begin() as conn:
+        for name in MEETING_COLUMNS:
+            if name not in existing:
+                conn.execute(text(f'ALTER TABLE teacher_class ADD COLUMN {name} INTEGER'))
+        rows = select(TeacherClass.teacher_id, TeacherClass.class_id, TeacherClass.day, TeacherClass.time)
+        if not reparse:
+            rows = rows.where(TeacherClass.days_mask.is_(None))
+        rows = conn.execute(rows).all()
+        updates = []
+        for teacher_id, class_id, day, time_text in rows:
+            meeting = schedule.parse_meeting(day, time_text)
+            if meeting or reparse:
+                updates.append({'t_id': teacher_id, 'c_id': class_id,
+                                **dict(zip(MEETING_COLUMNS, meeting or (None, None, None)))})
+        if updates:
+            table = TeacherClass.__table__
+            conn.execute(table.update()
+                         .where(table.c.teacher_id == bindparam('t_id'),
+                                table.c.class_id == bindparam('c_id'))
+                         .values({name: bindparam(name) for name in MEETING_COLUMNS}),
+                         updates)
+    return len(rows), len(updates)
+
+def migrate_meeting_slots():
+    # earlier parsing lost Thursday in 'MTWTF' and read 'TBA' as Tuesday
+    scanned, _ = migrate_meeting_times(reparse=True)
+    return scanned > 0
+
+def migrate_session_version():
+    existing = {column['name'] for column in inspect(db.engine).get_columns('user')}
+    if 'session_version' in existing:
+        return False
+    with db.engine.begin() as conn:
+        conn.execute(text('ALTER TABLE user ADD COLUMN session_version INTEGER NOT NULL DEFAULT 0'))
+    return True
+
+# full-text course search: an FTS5 index over Class.name/description,
+# kept in sync by triggers so every write path updates it
+CLASS_SEARCH_DDL = [
+    "DROP TABLE IF EXISTS class_search",
+    "CREATE VIRTUAL TABLE class_search USING fts5("
+    "name, description, content='class', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS class_search_insert AFTER INSERT ON class BEGIN "
+    "INSERT INTO class_search(rowid, name, description) VALUES (new.id, new.name, new.description); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS class_search_delete AFTER DELETE ON class BEGIN "
+    "INSERT INTO class_search(class_search, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS class_search_update AFTER UPDATE ON class BEGIN "
+    "INSERT INTO class_search(class_search, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO class_search(rowid, name, description) VALUES (new.id, new.name, new.description); "
+    "END",
+]
+# name matches count ten times as much as description matches
+SEARCH_RANK = "bm25(class_search, 10.0, 1.0)"
+
+for statement in CLASS_SEARCH_DDL:
+    # a fresh class table gets a fresh index
+    event.listen(Class.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+def migrate_class_search():
+    # databases created before the search index get it built from class
+    with db.engine.begin() as conn:
+        if conn.dialect.name != 'sqlite':
+            return False
+        if inspect(conn).has_table('class_search'):
+            return False
+        for statement in CLASS_SEARCH_DDL:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO class_search(class_search) VALUES ('rebuild')"))
+    return True
+
+def match_expression(query, prefix_last=True, column=None):
+    # user text -> FTS5 query: each word quoted so operators in the input
+    # are taken literally, the last word matching as a prefix
+    words = re.findall(r'\w+', query or '')
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if prefix_last:
+        terms[-1] += '*'
+    expression = ' AND '.join(terms)
+    return f'{column} : ({expression})' if column else expression
+
+def search_class_ids(query, limit, after=None, column=None, prefix_last=True):
+    # ranked (class id, score) pairs, keyset paged on (score, id)
+    expression = match_expression(query, prefix_last=prefix_last, column=column)
+    if expression is None:
+        return []
+    sql = f"""
+        SELECT id, score FROM (
+            SELECT rowid AS id, {SEARCH_RANK} AS score
+            FROM class_search WHERE class_search MATCH :match
+        )
+        WHERE id IN (SELECT id FROM class WHERE term_id = (SELECT id FROM term WHERE status = 'active'))
+        {'AND (score > :score OR (score = :score AND id > :id))' if after else ''}
+        ORDER BY score, id
+        LIMIT :limit
+    """
+    params = {'match': expression, 'limit': limit}
+    if after:
+        params['score'], params['id'] = after
+    return db.session.execute(text(sql), params).all()
+
+# grade analytics: running per-class statistics (count, sum, sum of
+# squares, min/max, histogram) and per-student GPA totals, kept current
+# by triggers on enrollment so every write path updates them
+GRADE_BUCKETS = 10  # 0-9, 10-19, ..., 90-100
+
+class ClassGradeStats(db.Model):
+    class_id = db.Column(db.Integer, db.ForeignKey('class.id'), primary_key=True)
+    grade_count = db.Column(db.Integer, nullable=False, default=0)
+    grade_sum = db.Column(db.Float, nullable=False, default=0.0)
+    grade_sum_sq = db.Column(db.Float, nullable=False, default=0.0)
+    min_grade = db.Column(db.Float, nullable=True)
+    max_grade = db.Column(db.Float, nullable=True)
+
+    @property
+    def mean(self):
+        return self.grade_sum / self.grade_count if self.grade_count else None
+
+    @property
+    def stddev(self):
+        if not self.grade_count:
+            return None
+        variance = self.grade_sum_sq / self.grade_count - self.mean ** 2
+        return max(variance, 0.0) ** 0.5
+
+class ClassGradeBucket(db.Model):
+    class_id = db.Column(db.Integer, db.ForeignKey('class.id'), primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)
+    grade_count = db.Column(db.Integer, nullable=False, default=0)
+
+class StudentGradeStats(db.Model):
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    grade_count = db.Column(db.Integer, nullable=False, default=0)
+    grade_sum = db.Column(db.Float, nullable=False, default=0.0)
+    grade_points = db.Column(db.Float, nullable=False, default=0.0)
+
+    @property
+    def gpa(self):
+        return self.grade_points / self.grade_count if self.grade_count else None
+
+def grade_bucket_sql(grade):
+    return f"max(0, min({GRADE_BUCKETS - 1}, CAST({grade} / 10 AS INTEGER)))"
+
+def grade_points_sql(grade):
+    # percentage -> 4.0 scale
+    return (f"CASE WHEN {grade} >= 90 THEN 4.0 WHEN {grade} >= 80 THEN 3.0 "
+            f"WHEN {grade} >= 70 THEN 2.0 WHEN {grade} >= 60 THEN 1.0 ELSE 0.0 END")
+
+def grade_stats_add(row):
+    # statements adding enrollment row `row` ('new') to the statistics
+    grade = f"{row}.grade"
+    return [
+        f"INSERT INTO class_grade_stats (class_id, grade_count, grade_sum, grade_sum_sq, min_grade, max_grade) "
+        f"SELECT {row}.class_id, 1, {grade}, {grade} * {grade}, {grade}, {grade} WHERE {grade} IS NOT NULL "
+        f"ON CONFLICT (class_id) DO UPDATE SET "
+        f"grade_count = grade_count + 1, "
+        f"grade_sum = grade_sum + excluded.grade_sum, "
+        f"grade_sum_sq = grade_sum_sq + excluded.grade_sum_sq, "
+        f"min_grade = min(coalesce(min_grade, excluded.min_grade), excluded.min_grade), "
+        f"max_grade = max(coalesce(max_grade, excluded.max_grade), excluded.max_grade)",
+        f"INSERT INTO class_grade_bucket (class_id, bucket, grade_count) "
+        f"SELECT {row}.class_id, {grade_bucket_sql(grade)}, 1 WHERE {grade} IS NOT NULL "
+        f"ON CONFLICT (class_id, bucket) DO UPDATE SET grade_count = grade_count + 1",
+        f"INSERT INTO student_grade_stats (student_id, grade_count, grade_sum, grade_points) "
+        f"SELECT {row}.student_id, 1, {grade}, {grade_points_sql(grade)} WHERE {grade} IS NOT NULL "
+        f"ON CONFLICT (student_id) DO UPDATE SET "
+        f"grade_count = grade_count + 1, "
+        f"grade_sum = grade_sum + excluded.grade_sum, "
+        f"grade_points = grade_points + excluded.grade_points",
+    ]
+
+def grade_stats_remove(row):
+    # statements taking enrollment row `row` ('old') out of the statistics
+    grade = f"{row}.grade"
+    return [
+        f"UPDATE class_grade_stats SET "
+        f"grade_count = grade_count - 1, "
+        f"grade_sum = grade_sum - {grade}, "
+        f"grade_sum_sq = grade_sum_sq - {grade} * {grade} "
+        f"WHERE class_id = {row}.class_id AND {grade} IS NOT NULL",
+        # only removing the current min or max needs a look at the class
+        f"UPDATE class_grade_stats SET "
+        f"min_grade = (SELECT min(grade) FROM enrollment WHERE class_id = {row}.class_id), "
+        f"max_grade = (SELECT max(grade) FROM enrollment WHERE class_id = {row}.class_id) "
+        f"WHERE class_id = {row}.class_id AND (min_grade = {grade} OR max_grade = {grade})",
+        f"UPDATE class_grade_bucket SET grade_count = grade_count - 1 "
+        f"WHERE class_id = {row}.class_id AND bucket = {grade_bucket_sql(grade)} AND {grade} IS NOT NULL",
+        f"UPDATE student_grade_stats SET "
+        f"grade_count = grade_count - 1, "
+        f"grade_sum = grade_sum - {grade}, "
+        f"grade_points = grade_points - {grade_points_sql(grade)} "
+        f"WHERE student_id = {row}.student_id AND {grade} IS NOT NULL",
+    ]
+
+def trigger_sql(name, event_sql, statements, table='enrollment', when=None):
+    body = ' '.join(f'{statement};' for statement in statements)
+    condition = f' WHEN {when}' if when else ''
+    return f"CREATE TRIGGER IF NOT EXISTS {name} {event_sql} ON {table}{condition} BEGIN {body} END"
+
+GRADE_STATS_TRIGGERS = [
+    trigger_sql('grade_stats_insert', 'AFTER INSERT', grade_stats_add('new')),
+    trigger_sql('grade_stats_delete', 'AFTER DELETE', grade_stats_remove('old')),
+    trigger_sql('grade_stats_update', 'AFTER UPDATE OF grade, class_id, student_id',
+                grade_stats_remove('old') + grade_stats_add('new')),
+]
+
+@event.listens_for(db.metadata, 'after_create')
+def create_grade_stats_triggers(target, connection, tables=(), **kw):
+    # only alongside a new, empty enrollment table; an existing one is
+    # picked up by migrate_grade_stats, which also fills the statistics
+    if connection.dialect.name == 'sqlite' and Enrollment.__table__ in tables:
+        for statement in GRADE_STATS_TRIGGERS:
+            connection.execute(text(statement))
+
+# the same statistics computed from scratch with GROUP BY, for
+# verifying and repairing the incrementally maintained tables
+RECOMPUTE_GRADE_STATS = {
+    'class_grade_stats': (
+        "SELECT class_id, count(grade), sum(grade), sum(grade * grade), min(grade), max(grade) "
+        "FROM enrollment WHERE grade IS NOT NULL GROUP BY class_id",
+        "SELECT class_id, grade_count, grade_sum, grade_sum_sq, min_grade, max_grade "
+        "FROM class_grade_stats WHERE grade_count > 0",
+    ),
+    'class_grade_bucket': (
+        f"SELECT class_id, {grade_bucket_sql('grade')} AS bucket, count(*) "
+        f"FROM enrollment WHERE grade IS NOT NULL GROUP BY class_id, bucket",
+        "SELECT class_id, bucket, grade_count FROM class_grade_bucket WHERE grade_count > 0",
+    ),
+    'student_grade_stats': (
+        f"SELECT student_id, count(grade), sum(grade), sum({grade_points_sql('grade')}) "
+        f"FROM enrollment WHERE grade IS NOT NULL GROUP BY student_id",
+        "SELECT student_id, grade_count, grade_sum, grade_points "
+        "FROM student_grade_stats WHERE grade_count > 0",
+    ),
+}
+# rows are keyed by their leading primary key columns
+GRADE_STATS_KEYS = {'class_grade_stats': 1, 'class_grade_bucket': 2, 'student_grade_stats': 1}
+GRADE_STATS_TOLERANCE = 1e-6
+
+def verify_grade_stats():
+    # table -> list of (key, maintained, recomputed) that disagree
+    mismatches = {}
+    with db.engine.connect() as conn:
+        for table, (recompute_sql, stored_sql) in RECOMPUTE_GRADE_STATS.items():
+            width = GRADE_STATS_KEYS[table]
+            expected = {tuple(row[:width]): tuple(row[width:]) for row in conn.execute(text(recompute_sql))}
+            stored = {tuple(row[:width]): tuple(row[width:]) for row in conn.execute(text(stored_sql))}
+            bad = []
+            for key in expected.keys() | stored.keys():
+                want, have = expected.get(key), stored.get(key)
+                if want is None or have is None or any(
+                        abs((a or 0) - (b or 0)) > GRADE_STATS_TOLERANCE for a, b in zip(want, have)):
+                    bad.append((key, have, want))
+            if bad:
+                mismatches[table] = bad
+    return mismatches
+
+def recompute_grade_stats():
+    with db.engine.begin() as conn:
+        for table, (recompute_sql, _) in RECOMPUTE_GRADE_STATS.items():
+            conn.execute(text(f"DELETE FROM {table}"))
+            conn.execute(text(f"INSERT INTO {table} {recompute_sql}"))
+
+def migrate_grade_stats():
+    # databases created before the statistics get the tables, triggers
+    # and a first full computation
+    with db.engine.begin() as conn:
+        if conn.dialect.name != 'sqlite':
+            return False
+        if conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' "
+                             "AND name = 'grade_stats_insert'")).first():
+            return False
+        for model in (ClassGradeStats, ClassGradeBucket, StudentGradeStats):
+            model.__table__.create(conn, checkfirst=True)
+        for statement in GRADE_STATS_TRIGGERS:
+            conn.execute(text(statement))
+    recompute_grade_stats()
+    return True
+
+@bp.cli.command('grade-stats')
+@click.option('--repair', is_flag=True, help='Rebuild the statistics if they disagree.')
+def grade_stats_command(repair):
+    mismatches = verify_grade_stats()
+    for table, bad in mismatches.items():
+        click.echo(f'{table}: {len(bad)} row(s) disagree', err=True)
+        for key, have, want in bad[:10]:
+            click.echo(f'  {key}: maintained {have}, recomputed {want}', err=True)
+    if not mismatches:
+        click.echo('grade statistics match the enrollment table')
+    elif repair:
+        recompute_grade_stats()
+        click.echo('grade statistics rebuilt')
+
+# course catalog shared by every student: one aggregated query
+# builds the rows, which are cached until a write touches the class
+DEFAULT_MAX_SEATS = 30
+
+def query_catalog_rows(class_ids=None):
+    # a class shows its first teacher, same as class_.teachers[0]
+    first_teacher = db.session.query(
+        TeacherClass.class_id,
+        func.min(TeacherClass.teacher_id).label('teacher_id'),
+    ).group_by(TeacherClass.class_id)
+    seat_counts = db.session.query(
+        Enrollment.class_id,
+        func.count().label('student_count'),
+    ).group_by(Enrollment.class_id)
+    if class_ids is None:
+        # the whole catalog is the active term's classes
+        class_ids = select(Class.id).where(Class.term_id == active_term())
+    first_teacher = first_teacher.filter(TeacherClass.class_id.in_(class_ids))
+    seat_counts = seat_counts.filter(Enrollment.class_id.in_(class_ids))
+    first_teacher = first_teacher.subquery()
+    seat_counts = seat_counts.subquery()
+
+    query = db.session.query(
+        Class.id,
+        Class.name,
+        TeacherClass.teacher_id,
+        User.uni_id,
+        TeacherClass.day,
+        TeacherClass.time,
+        TeacherClass.max_seats,
+        func.coalesce(seat_counts.c.student_count, 0),
+        TeacherClass.days_mask,
+        TeacherClass.start_minute,
+        TeacherClass.end_minute,
+        func.coalesce(EntityVersion.version, 0),
+    ).outerjoin(first_teacher, first_teacher.c.class_id == Class.id)\
+        .outerjoin(TeacherClass, and_(TeacherClass.class_id == first_teacher.c.class_id,
+                                      TeacherClass.teacher_id == first_teacher.c.teacher_id))\
+        .outerjoin(User, User.id == TeacherClass.teacher_id)\
+        .outerjoin(seat_counts, seat_counts.c.class_id == Class.id)\
+        .outerjoin(EntityVersion, and_(EntityVersion.entity == 'class', EntityVersion.entity_id == Class.id))\
+        .filter(Class.id.in_(class_ids), Class.term_id == active_term())
+
+    rows = {}
+    for (class_id, name, teacher_id, teacher_name, day, class_time, max_seats, student_count,
+         days_mask, start_minute, end_minute, version) in query:
+        has_teacher = teacher_name is not None
+        max_seats = max_seats if has_teacher else DEFAULT_MAX_SEATS
+        rows[class_id] = {
+            "id": class_id,
+            "name": name,
+            "teacher_id": teacher_id,
+            "teacher_name": teacher_name if has_teacher else "TBA",
+            "day": day if has_teacher else "TBD",
+            "time": class_time if has_teacher else "TBD",
+            "student_count": student_count,
+            "is_full": student_count >= max_seats,
+            "max_seats": max_seats,
+            "meeting": (days_mask, start_minute, end_minute) if days_mask else None,
+            "version": version,
+        }
+    return rows
+
+# catalog change log: triggers append the id of every class whose
+# catalog row may have changed, so each worker process can drop just
+# those rows from its cache when another process writes
+CATALOG_CHANGE_KEEP = 10000    # older entries are pruned
+CATALOG_SYNC_LIMIT = 1000      # more changes than this reloads everything
+CATALOG_ALL = 0                # logged for changes to every class at once
+
+class CatalogChange(db.Model):
+    __table_args__ = {'sqlite_autoincrement': True}
+    seq = db.Column(db.Integer, primary_key=True)
+    class_id = db.Column(db.Integer, nullable=False)
+
+def catalog_change(class_id):
+    return f'INSERT INTO catalog_change (class_id) VALUES ({class_id})'
+
+CATALOG_CHANGE_TRIGGERS = [
+    trigger_sql('catalog_enrollment_insert', 'AFTER INSERT', [catalog_change('new.class_id')]),
+    trigger_sql('catalog_enrollment_delete', 'AFTER DELETE', [catalog_change('old.class_id')]),
+    trigger_sql('catalog_enrollment_update', 'AFTER UPDATE OF class_id',
+                [catalog_change('old.class_id'), catalog_change('new.class_id')]),
+    trigger_sql('catalog_section_insert', 'AFTER INSERT', [catalog_change('new.class_id')],
+                table='teacher_class'),
+    trigger_sql('catalog_section_delete', 'AFTER DELETE', [catalog_change('old.class_id')],
+                table='teacher_class'),
+    trigger_sql('catalog_section_update', 'AFTER UPDATE',
+                [catalog_change('old.class_id'), catalog_change('new.class_id')],
+                table='teacher_class'),
+    trigger_sql('catalog_class_insert', 'AFTER INSERT', [catalog_change('new.id')], table='class'),
+    trigger_sql('catalog_class_delete', 'AFTER DELETE', [catalog_change('old.id')], table='class'),
+    trigger_sql('catalog_class_update', 'AFTER UPDATE', [catalog_change('new.id')], table='class'),
+    trigger_sql('catalog_change_prune', 'AFTER INSERT', [
+        f'DELETE FROM catalog_change WHERE seq <= new.seq - {CATALOG_CHANGE_KEEP}',
+    ], table='catalog_change', when=f'new.seq % {CATALOG_SYNC_LIMIT} = 0'),
+]
+
+# starting a term swaps the whole catalog
+TERM_TRIGGERS = [
+    trigger_sql('catalog_term_insert', 'AFTER INSERT', [catalog_change(CATALOG_ALL)], table='term'),
+    trigger_sql('catalog_term_update', 'AFTER UPDATE OF status', [catalog_change(CATALOG_ALL)], table='term'),
+]
+
+def migrate_catalog_changes():
+    # nothing to backfill: a cache only needs changes made after it loaded
+    with db.engine.begin() as conn:
+        if conn.dialect.name != 'sqlite':
+            return False
+        if conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' "
+                             "AND name = 'catalog_change_prune'")).first():
+            return False
+        CatalogChange.__table__.create(conn, checkfirst=True)
+        for statement in CATALOG_CHANGE_TRIGGERS:
+            conn.execute(text(statement))
+    return True
+
+@event.listens_for(db.metadata, 'after_create')
+def create_catalog_change_triggers(target, connection, tables=(), **kw):
+    if connection.dialect.name == 'sqlite' and CatalogChange.__table__ in tables:
+        for statement in CATALOG_CHANGE_TRIGGERS:
+            connection.execute(text(statement))
+
+@event.listens_for(db.metadata, 'after_create')
+def create_term_triggers(target, connection, tables=(), **kw):
+    if connection.dialect.name == 'sqlite' and Term.__table__ in tables:
+        for statement in TERM_TRIGGERS:
+            connection.execute(text(statement))
+
+def migrate_terms():
+    # create_all adds the term table with the first term in it; classes
+    # from before terms all belong to that one
+    existing = {column['name'] for column in inspect(db.engine).get_columns('class')}
+    if 'term_id' in existing:
+        return False
+    with db.engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE class ADD COLUMN term_id INTEGER NOT NULL DEFAULT {DEFAULT_TERM_ID}'))
+    migrate_indexes()
+    return True
+
+# page versions: a counter per class, per student and for the catalog
+# as a whole, bumped by triggers on every write the pages show. They
+# make the ETags for conditional GETs and the keys of cached fragments.
+UNIX_NOW_SQL = "(julianday('now') - 2440587.5) * 86400.0"
+
+class EntityVersion(db.Model):
+    entity = db.Column(db.String(20), primary_key=True)  # 'class', 'student' or 'catalog'
+    entity_id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    changed_at = db.Column(db.Float, nullable=False)     # unix time
+
+def bump_version(entity, entity_id, source=None):
+    # source is a SELECT of ids to bump instead of the single entity_id
+    upsert = ("ON CONFLICT (entity, entity_id) DO UPDATE "
+              "SET version = version + 1, changed_at = excluded.changed_at")
+    if source:
+        return (f"INSERT INTO entity_version (entity, entity_id, version, changed_at) "
+                f"SELECT '{entity}', {entity_id}, 1, {UNIX_NOW_SQL} {source} {upsert}")
+    return (f"INSERT INTO entity_version (entity, entity_id, version, changed_at) "
+            f"VALUES ('{entity}', {entity_id}, 1, {UNIX_NOW_SQL}) {upsert}")
+
+ENTITY_VERSION_TRIGGERS = [
+    trigger_sql('version_enrollment_insert', 'AFTER INSERT', [
+        bump_version('class', 'new.class_id'), bump_version('student', 'new.student_id'),
+    ]),
+    trigger_sql('version_enrollment_delete', 'AFTER DELETE', [
+        bump_version('class', 'old.class_id'), bump_version('student', 'old.student_id'),
+    ]),
+    trigger_sql('version_enrollment_update', 'AFTER UPDATE', [
+        bump_version('class', 'old.class_id'), bump_version('student', 'old.student_id'),
+    ]),
+    trigger_sql('version_enrollment_move', 'AFTER UPDATE OF class_id, student_id', [
+        bump_version('class', 'new.class_id'), bump_version('student', 'new.student_id'),
+    ], when='new.class_id != old.class_id OR new.student_id != old.student_id'),
+    trigger_sql('version_section_insert', 'AFTER INSERT', [bump_version('class', 'new.class_id')],
+                table='teacher_class'),
+    trigger_sql('version_section_delete', 'AFTER DELETE', [bump_version('class', 'old.class_id')],
+                table='teacher_class'),
+    trigger_sql('version_section_update', 'AFTER UPDATE', [
+        bump_version('class', 'old.class_id'), bump_version('class', 'new.class_id'),
+    ], table='teacher_class'),
+    trigger_sql('version_class_insert', 'AFTER INSERT', [bump_version('class', 'new.id')], table='class'),
+    trigger_sql('version_class_delete', 'AFTER DELETE', [bump_version('class', 'old.id')], table='class'),
+    trigger_sql('version_class_update', 'AFTER UPDATE', [bump_version('class', 'new.id')], table='class'),
+    # anything that changes a catalog row changes the catalog
+    trigger_sql('version_catalog', 'AFTER INSERT', [bump_version('catalog', 0)], table='catalog_change'),
+    trigger_sql('version_waitlist_insert', 'AFTER INSERT', [bump_version('student', 'new.student_id')],
+                table='waitlist'),
+    # everyone still waiting moves up a place
+    trigger_sql('version_waitlist_delete', 'AFTER DELETE', [
+        bump_version('student', 'old.student_id'),
+        bump_version('student', 'student_id',
+                     source='FROM waitlist WHERE class_id = old.class_id AND true'),
+    ], table='waitlist'),
+]
+
+def migrate_entity_versions():
+    # nothing to backfill: an entity that was never bumped is at version 0
+    with db.engine.begin() as conn:
+        if conn.dialect.name != 'sqlite':
+            return False
+        if conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' "
+                             "AND name = 'version_waitlist_delete'")).first():
+            return False
+        EntityVersion.__table__.create(conn, checkfirst=True)
+        for statement in ENTITY_VERSION_TRIGGERS:
+            conn.execute(text(statement))
+    return True
+
+@event.listens_for(db.metadata, 'after_create')
+def create_entity_version_triggers(target, connection, tables=(), **kw):
+    if connection.dialect.name == 'sqlite' and EntityVersion.__table__ in tables:
+        for statement in ENTITY_VERSION_TRIGGERS:
+            connection.execute(text(statement))
+
+# rosters and catalog rows show uni ids, so renaming a user changes the
+# classes they teach or take
+USER_RENAME_TRIGGERS = [
+    trigger_sql('user_rename', 'AFTER UPDATE OF uni_id', [
+        'INSERT INTO catalog_change (class_id) SELECT class_id FROM teacher_class WHERE teacher_id = new.id',
+        bump_version('class', 'class_id', source='FROM teacher_class WHERE teacher_id = new.id AND true'),
+        bump_version('class', 'class_id', source='FROM enrollment WHERE student_id = new.id AND true'),
+        bump_version('student', 'new.id'),
+    ], table='user', when='new.uni_id IS NOT old.uni_id'),
+]
+
+def migrate_user_rename_triggers():
+    with db.engine.begin() as conn:
+        if conn.dialect.name != 'sqlite':
+            return False
+        if conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' "
+                             "AND name = 'user_rename'")).first():
+            return False
+        for statement in USER_RENAME_TRIGGERS:
+            conn.execute(text(statement))
+    return True
+
+@event.listens_for(db.metadata, 'after_create')
+def create_user_rename_triggers(target, connection, tables=(), **kw):
+    if connection.dialect.name == 'sqlite' and User.__table__ in tables:
+        for statement in USER_RENAME_TRIGGERS:
+            connection.execute(text(statement))
+
+def migrate_indexes():
+    # create_all only builds indexes along with a new table, so ones
+    # declared later on an existing table are added here
+    created = []
+    with db.engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for index in table.indexes:
+                # an index on a column a later step adds is made by that step
+                if inspector.has_index(table.name, index.name) or \
+                        not {column.name for column in index.columns} <= columns:
+                    continue
+                index.create(conn)
+                created.append(index.name)
+        if created and conn.dialect.name == 'sqlite':
+            # the planner's statistics for the new indexes
+            for name in created:
+                conn.execute(text(f'ANALYZE {name}'))
+    return bool(created)
+
+# schema versions: PRAGMA user_version holds the last migration applied
+# to the file. A new database gets every table, index and trigger from
+# create_all and starts at the latest version; an older one runs the
+# steps after its version, in order. Each step looks before it changes
+# anything, so files from before versioning (version 0) run them all.
+MIGRATIONS = (
+    (1, migrate_class_search, 'course search index built'),
+    (2, migrate_grade_stats, 'grade statistics built'),
+    (3, migrate_catalog_changes, 'catalog change log added'),
+    (4, migrate_session_version, 'user session versions added'),
+    (5, migrate_entity_versions, 'page versions added'),
+    (6, migrate_indexes, 'per-class enrollment and section indexes added'),
+    (7, migrate_terms, 'terms added, existing classes put in the first term'),
+    (8, migrate_meeting_slots, 'meeting slots reparsed'),
+    (9, migrate_user_rename_triggers, 'pages refresh when a user is renamed'),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def schema_version(conn):
+    if conn.dialect.name != 'sqlite':
+        return 0
+    return conn.exec_driver_sql('PRAGMA user_version').scalar()
+
+def set_schema_version(conn, version):
+    if conn.dialect.name == 'sqlite':
+        conn.exec_driver_sql(f'PRAGMA user_version = {int(version)}')
+
+@event.listens_for(db.metadata, 'after_create')
+def stamp_schema_version(target, connection, tables=(), **kw):
+    # a database created from scratch is already at the latest version
+    if User.__table__ in tables:
+        set_schema_version(connection, SCHEMA_VERSION)
+
+def upgrade_database():
+    # brings a database created by an older version up to date and
+    # returns a line for each step that did something
+    db.create_all()  # tables added since
+    scanned, parsed = migrate_meeting_times()
+    done = [f'{parsed} of {scanned} sections without meeting slots parsed']
+    with db.engine.connect() as conn:
+        version = schema_version(conn)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f'database schema is at version {version}, '
+                           f'newer than this code ({SCHEMA_VERSION})')
+    for number, migrate, message in MIGRATIONS:
+        if number <= version:
+            continue
+        if migrate():
+            done.append(message)
+        with db.engine.begin() as conn:
+            set_schema_version(conn, number)
+    done.append(f'schema at version {SCHEMA_VERSION}')
+    return done
+
+@bp.cli.command('upgrade-db')
+def upgrade_db_command():
+    try:
+        done = upgrade_database()
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    for line in done:
+        click.echo(line)
+
+def entity_versions(keys):
+    # {(entity, entity_id): (version, changed_at)}; never-bumped ones are left out
+    by_entity = {}
+    for entity, entity_id in keys:
+        by_entity.setdefault(entity, []).append(entity_id)
+    # one IN list per entity: SQLite can't search the primary key for a
+    # row-value IN over a list of pairs and scans the table instead
+    rows = db.session.query(EntityVersion.entity, EntityVersion.entity_id,
+                            EntityVersion.version, EntityVersion.changed_at)\
+        .filter(or_(*(and_(EntityVersion.entity == entity, EntityVersion.entity_id.in_(ids))
+                      for entity, ids in by_entity.items())))
+    return {(entity, entity_id): (version, changed_at)
+            for entity, entity_id, version, changed_at in rows}
+
+class CatalogCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = None       # class id -> row, None until first load
+        self._sorted = None        # rows in class id order
+        self.version = 0
+        self._stale = {}           # class id -> version it was invalidated at
+        self._seen = None          # last catalog_change seq applied
+
+    def invalidate(self, *class_ids):
+        # no ids drops the whole catalog
+        with self._lock:
+            self.version += 1
+            if not class_ids:
+                self._entries = None
+                self._sorted = None
+                self._stale.clear()
+                return
+            for class_id in class_ids:
+                if class_id is not None:
+                    self._stale[class_id] = self.version
+
+    def sync(self):
+        # apply changes other processes logged since the last look; once
+        # per request, this process's own writes invalidate directly. The
+        # flag lives in the WSGI environ: g is the app context's, which a
+        # test client or CLI command can keep across several requests
+        if has_request_context():
+            if request.environ.get('school.catalog_synced'):
+                return
+            request.environ['school.catalog_synced'] = True
+        seen = self._seen
+        if seen is None:
+            latest = db.session.scalar(select(func.coalesce(func.max(CatalogChange.seq), 0)))
+            self._advance(latest)
+            return
+        changes = db.session.execute(
+            select(CatalogChange.seq, CatalogChange.class_id)
+            .where(CatalogChange.seq > seen)
+            .order_by(CatalogChange.seq)
+            .limit(CATALOG_SYNC_LIMIT + 1)
+        ).all()
+        if not changes:
+            return
+        if len(changes) > CATALOG_SYNC_LIMIT or changes[0].seq != seen + 1:
+            # too many, or pruned before we saw them
+            latest = db.session.scalar(select(func.max(CatalogChange.seq)))
+            self.invalidate()
+            self._advance(latest)
+            return
+        class_ids = {change.class_id for change in changes}
+        if CATALOG_ALL in class_ids:
+            self.invalidate()
+        else:
+            self.invalidate(*class_ids)
+        self._advance(changes[-1].seq)
+
+    def _advance(self, seq):
+        with self._lock:
+            if self._seen is None or seq > self._seen:
+                self._seen = seq
+
+    def get(self, class_id):
+        self.sync()
+        with self._lock:
+            if self._entries is not None and class_id not in self._stale:
+                return self._entries.get(class_id)
+        self.rows()
+        with self._lock:
+            return (self._entries or {}).get(class_id)
+
+    def get_many(self, class_ids):
+        # one sync for the lot; None for ids that aren't classes
+        ordered = self.rows()
+        with self._lock:
+            entries = self._entries
+        if entries is None:
+            entries = {row["id"]: row for row in ordered}
+        return [entries.get(class_id) for class_id in class_ids]
+
+    def rows(self):
+        self.sync()
+        while True:
+            with self._lock:
+                entries = self._entries
+                stale = dict(self._stale)
+                version = self.version
+                if entries is not None and not stale:
+                    return self._sorted
+
+            if entries is None:
+                fresh = query_catalog_rows()
+            else:
+                fresh = query_catalog_rows(list(stale))
+
+            with self._lock:
+                if entries is None:
+                    if self._entries is not None:
+                        continue
+                    ordered = sorted(fresh.values(), key=lambda row: row["id"])
+                    # only keep it if nothing was invalidated while loading
+                    if self.version == version:
+                        self._entries = fresh
+                        self._sorted = ordered
+                    return ordered
+
+                if self._entries is not entries:
+                    continue
+                for class_id, stale_at in stale.items():
+                    # a newer invalidation means this result may be outdated
+                    if self._stale.get(class_id) != stale_at:
+                        continue
+                    del self._stale[class_id]
+                    if class_id in fresh:
+                        entries[class_id] = fresh[class_id]
+                    else:
+                        entries.pop(class_id, None)
+                self._sorted = sorted(entries.values(), key=lambda row: row["id"])
+                return self._sorted
+
+catalog = CatalogCache()
+
+# seat reservation: admission is a single conditional INSERT, so the
+# seat check and the insert happen under the same write lock and a
+# section can never go over max_seats
+RESERVE_RETRIES = 5
+RESERVE_BACKOFF = 0.05
+
+def seat_limit(class_id):
+    # same seat limit the catalog shows: the first teacher's max_seats
+    max_seats = select(TeacherClass.max_seats)\
+        .where(TeacherClass.class_id == class_id)\
+        .order_by(TeacherClass.teacher_id)\
+        .limit(1)\
+        .scalar_subquery()
+    return func.coalesce(max_seats, DEFAULT_MAX_SEATS)
+
+# made once, adapting columns to a new alias is slow
+OTHER_SECTION = aliased(TeacherClass)
+WANTED_SECTION = aliased(TeacherClass)
+HELD_SECTION = aliased(TeacherClass)
+
+def first_section(section):
+    # the section whose meeting time the catalog shows: the first teacher's
+    other = OTHER_SECTION
+    first_teacher = select(func.min(other.teacher_id))\
+        .where(other.class_id == section.class_id)\
+        .correlate_except(other)\
+        .scalar_subquery()
+    return section.teacher_id == first_teacher
+
+def meeting_overlap(student_id, class_id):
+    # true when the class meets at the same time as another of the
+    # student's classes this term; Timetable.conflicts in SQL, so it can
+    # sit inside a conditional INSERT
+    wanted = WANTED_SECTION
+    held = HELD_SECTION
+    return select(held.class_id)\
+        .select_from(Enrollment)\
+        .join(held, held.class_id == Enrollment.class_id)\
+        .join(wanted, wanted.class_id == class_id)\
+        .where(Enrollment.student_id == student_id, Enrollment.class_id != class_id,
+               in_term(Enrollment.class_id), first_section(held), first_section(wanted),
+               wanted.days_mask.op('&')(held.days_mask) != 0,
+               held.start_minute < wanted.end_minute, held.end_minute > wanted.start_minute)\
+        .exists()
+
+@cache
+def admission_statement():
+    # built once, run with student_id and class_id parameters
+    student_id = bindparam('student_id', type_=Integer)
+    class_id = bindparam('class_id', type_=Integer)
+    seats_taken = select(func.count())\
+        .select_from(Enrollment)\
+        .where(Enrollment.class_id == class_id)\
+        .scalar_subquery()
+    already_enrolled = select(Enrollment.student_id)\
+        .where(Enrollment.student_id == student_id, Enrollment.class_id == class_id)\
+        .exists()
+    # the seat count and the schedule are checked in the same statement
+    # as the insert, so concurrent enrolls can't both pass either check
+    admission = select(student_id, class_id)\
+        .where(in_term(class_id), ~already_enrolled, seats_taken < seat_limit(class_id),
+               ~meeting_overlap(student_id, class_id))
+    # the Core table: an ORM insert run with parameters is a bulk insert.
+    # No grade yet: NULL, which the grade statistics leave out
+    return insert(Enrollment.__table__).from_select(['student_id', 'class_id'], admission)
+
+def admission_failure(student_id, class_id):
+    # why the admission insert didn't add a row
+    if not db.session.scalar(select(in_term(class_id))):
+        return 'no_such_class'  # or not offered this term
+    if db.session.get(Enrollment, (student_id, class_id)) is not None:
+        return 'already_enrolled'
+    if db.session.scalar(select(meeting_overlap(student_id, class_id))):
+        return 'conflict'
+    return 'full'
+
+def reserve_seat(student_id, class_id):
+    # returns 'enrolled', 'already_enrolled', 'full', 'conflict' or
+    # 'no_such_class'
+    stmt = admission_statement()
+    params = {'student_id': student_id, 'class_id': class_id}
+    for attempt in range(RESERVE_RETRIES):
+        try:
+            admitted = db.session.execute(stmt, params).rowcount == 1
+            db.session.commit()
+            break
+        except IntegrityError:
+            db.session.rollback()
+            return 'already_enrolled'
+        except OperationalError as e:
+            db.session.rollback()
+            # still locked after busy_timeout, back off and try again
+            if 'locked' not in str(e.orig) or attempt == RESERVE_RETRIES - 1:
+                raise
+            time.sleep(RESERVE_BACKOFF * (2 ** attempt))
+
+    if admitted:
+        catalog.invalidate(class_id)
+        return 'enrolled'
+    return admission_failure(student_id, class_id)
+
+# waitlist promotion: fills the free seats of any number of classes
+# from the front of their queues with one INSERT ... SELECT, in the
+# caller's transaction. Students whose classes now clash with the
+# section are passed over and keep their place.
+def promote_waitlist(class_ids):
+    class_ids = list(class_ids)
+    if not class_ids:
+        return 0
+    limits = select(Class.id.label('class_id'), seat_limit(Class.id).label('max_seats'))\
+        .where(Class.id.in_(class_ids))\
+        .subquery()
+    taken = select(Enrollment.class_id, func.count().label('taken'))\
+        .where(Enrollment.class_id.in_(class_ids))\
+        .group_by(Enrollment.class_id)\
+        .subquery()
+    already_enrolled = select(Enrollment.student_id)\
+        .where(Enrollment.student_id == Waitlist.student_id, Enrollment.class_id == Waitlist.class_id)\
+        .exists()
+    queue = select(
+        Waitlist.student_id,
+        Waitlist.class_id,
+        func.row_number().over(partition_by=Waitlist.class_id, order_by=Waitlist.id).label('place'),
+        (limits.c.max_seats - func.coalesce(taken.c.taken, 0)).label('free_seats'),
+    ).join(limits, limits.c.class_id == Waitlist.class_id)\
+        .outerjoin(taken, taken.c.class_id == Waitlist.class_id)\
+        .where(~already_enrolled, ~meeting_overlap(Waitlist.student_id, Waitlist.class_id))\
+        .subquery()
+    promoted = db.session.execute(
+        insert(Enrollment).from_select(
+            ['student_id', 'class_id'],
+            select(queue.c.student_id, queue.c.class_id)
+            .where(queue.c.place <= queue.c.free_seats),
+        )
+    ).rowcount
+    if promoted:
+        db.session.execute(
+            Waitlist.__table__.delete()
+            .where(Waitlist.class_id.in_(class_ids), already_enrolled)
+        )
+    return promoted
+
+def join_waitlist(student_id, class_id):
+    # returns 'waitlisted', 'already_waitlisted' or the reserve_seat
+    # status when a seat was free after all
+    status = reserve_seat(student_id, class_id)
+    if status != 'full':
+        return status
+    try:
+        db.session.add(Waitlist(student_id=student_id, class_id=class_id))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return 'already_waitlisted'
+    return 'waitlisted'
+
+def waitlist_positions(student_id):
+    # class id -> 1-based place in line, one index range count per class
+    ahead = aliased(Waitlist)
+    place = select(func.count())\
+        .select_from(ahead)\
+        .where(ahead.class_id == Waitlist.class_id, ahead.id <= Waitlist.id)\
+        .scalar_subquery()
+    return dict(db.session.query(Waitlist.class_id, place).filter(Waitlist.student_id == student_id))
+
+# schedule conflicts: a student's meetings go into a per-weekday
+# interval index, built from the cached catalog rows
+def enrolled_class_ids(student_id):
+    # this term's classes
+    return {class_id for (class_id,) in db.session.query(Enrollment.class_id)
+            .filter(Enrollment.student_id == student_id, in_term(Enrollment.class_id))}
+
+def student_timetable(class_ids):
+    meetings = []
+    class_ids = list(class_ids)
+    for class_id, row in zip(class_ids, catalog.get_many(class_ids)):
+        if row and row["meeting"]:
+            meetings.append((*row["meeting"], class_id))
+    return schedule.Timetable(meetings)
+
+def schedule_conflicts(student_id, class_id):
+    # names of the student's classes that meet at the same time
+    row = catalog.get(class_id)
+    if not row or not row["meeting"]:
+        return []
+    enrolled = enrolled_class_ids(student_id) - {class_id}
+    conflicts = student_timetable(enrolled).conflicts(*row["meeting"])
+    return [row["name"] for row in catalog.get_many(conflicts)]
+
+def sections_fitting(class_ids, days_mask=None, start_after=None, end_before=None):
+    # open catalog rows that fit around the given classes, optionally
+    # limited to some weekdays and a window of the day
+    timetable = student_timetable(class_ids)
+    fitting = []
+    for row in catalog.rows():
+        meeting = row["meeting"]
+        if row["id"] in class_ids or row["is_full"] or not meeting:
+            continue
+        row_days, start, end = meeting
+        if days_mask is not None and row_days & ~days_mask:
+            continue
+        if start_after is not None and start < start_after:
+            continue
+        if end_before is not None and end > end_before:
+            continue
+        if timetable.fits(row_days, start, end):
+            fitting.append(row)
+    return fitting
+
+# term changes: starting a term closes the active one; archiving moves a
+# closed term's enrollments and sections to the archive database one
+# class at a time, copying first and deleting second, so an interrupted
+# run loses nothing and can simply be run again
+def start_term(name):
+    closing = db.session.scalar(select(Term.id).where(Term.status == 'active'))
+    db.session.execute(update(Term).where(Term.status == 'active').values(status='closed'))
+    term = Term(name=name, status='active')
+    db.session.add(term)
+    # nobody moves up a waitlist of a term that is over
+    db.session.execute(delete(Waitlist).where(in_term(Waitlist.class_id, closing)))
+    db.session.commit()
+    catalog.invalidate()
+    return term
+
+def archive_class(term_id, class_id):
+    # returns (enrollments, sections) moved
+    enrollments = db.session.execute(
+        select(Enrollment.student_id, literal(term_id).label('term_id'), Enrollment.class_id,
+               Class.name.label('class_name'), Enrollment.grade,
+               literal_column(grade_points_sql('enrollment.grade')).label('grade_points'),
+               (ClassGradeStats.grade_sum / func.nullif(ClassGradeStats.grade_count, 0)).label('class_average'))
+        .join(Class, Class.id == Enrollment.class_id)
+        .outerjoin(ClassGradeStats, ClassGradeStats.class_id == Enrollment.class_id)
+        .where(Enrollment.class_id == class_id)
+    ).mappings().all()
+    sections = db.session.execute(
+        select(literal(term_id).label('term_id'), TeacherClass.class_id, TeacherClass.teacher_id,
+               User.uni_id.label('teacher_name'), TeacherClass.day, TeacherClass.time, TeacherClass.max_seats)
+        .outerjoin(User, User.id == TeacherClass.teacher_id)
+        .where(TeacherClass.class_id == class_id)
+    ).mappings().all()
+    # rows already there from an interrupted run are replaced
+    if enrollments:
+        db.session.execute(insert(ArchivedEnrollment).prefix_with('OR REPLACE'), enrollments)
+    if sections:
+        db.session.execute(insert(ArchivedSection).prefix_with('OR REPLACE'), sections)
+    db.session.commit()
+
+    db.session.execute(delete(Enrollment).where(Enrollment.class_id == class_id))
+    db.session.execute(delete(TeacherClass).where(TeacherClass.class_id == class_id))
+    db.session.execute(delete(ClassGradeStats).where(ClassGradeStats.class_id == class_id))
+    db.session.execute(delete(ClassGradeBucket).where(ClassGradeBucket.class_id == class_id))
+    db.session.commit()
+    return len(enrollments), len(sections)
+
+def archive_term(term_id):
+    # returns (classes, enrollments, sections) archived
+    term = db.session.get(Term, term_id)
+    if term is None:
+        raise ValueError(f'no term {term_id}')
+    if term.status == 'active':
+        raise ValueError(f'term {term_id} ({term.name}) is active; start the next one first')
+    class_ids = db.session.scalars(select(Class.id).where(Class.term_id == term_id).order_by(Class.id)).all()
+    enrollments = sections = 0
+    for class_id in class_ids:
+        moved_enrollments, moved_sections = archive_class(term_id, class_id)
+        enrollments += moved_enrollments
+        sections += moved_sections
+    term.status = 'archived'
+    db.session.commit()
+    return len(class_ids), enrollments, sections
+
+@bp.cli.command('start-term')
+@click.argument('name')
+def start_term_command(name):
+    try:
+        term = start_term(name)
+    except IntegrityError:
+        db.session.rollback()
+        raise click.ClickException(f'there is already a term named {name!r}')
+    click.echo(f'term {term.id} ({term.name}) is now active')
+
+@bp.cli.command('archive-term')
+@click.argument('term_id', type=int)
+def archive_term_command(term_id):
+    try:
+        classes, enrollments, sections = archive_term(term_id)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'{enrollments} enrollments and {sections} sections of {classes} classes archived')
+
+# signed-in users: the session carries the user's id, role and session
+# version, and the rest of the identity comes from a small in-process
+# cache, so pages don't look the user up on every request. Admin edits
+# drop the cached entry here; other worker processes notice within the TTL.
+IDENTITY_CACHE_SIZE = 10000
+IDENTITY_TTL = 60  # seconds
+
+Identity = namedtuple('Identity', 'id uni_id role version')
+
+LOGIN_PAGES = {'student': 'main.student_login', 'teacher': 'main.teacher_login'}
+
+class LRUCache:
+    # bounded, least recently used out first; entries expire after ttl
+    # seconds when one is given
+    def __init__(self, size, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, expires at), oldest first
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        # no keys drops every entry
+        with self._lock:
+            if not keys:
+                self._entries.clear()
+            for key in keys:
+                self._entries.pop(key, None)
+
+identities = LRUCache(IDENTITY_CACHE_SIZE, IDENTITY_TTL)
+
+def identity_of(user):
+    return Identity(user.id, user.uni_id, user.role, user.session_version)
+
+def sign_in(user):
+    session['identity'] = {'id': user.id, 'role': user.role, 'version': user.session_version}
+    identity = identity_of(user)
+    identities.put(identity.id, identity)
+
+def current_identity():
+    stamp = session.get('identity')
+    if not stamp:
+        return None
+    identity = identities.get(stamp['id'])
+    if identity is None:
+        user = db.session.get(User, stamp['id'])
+        if user is None:
+            return None
+        identity = identity_of(user)
+        identities.put(identity.id, identity)
+    # edited or deleted since this session signed in
+    if identity.version != stamp['version'] or identity.role != stamp['role']:
+        session.pop('identity', None)
+        return None
+    return identity
+
+def login_required(role=None):
+    # sends visitors without a matching identity to the login page and
+    # leaves the signed-in user in g.identity
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            identity = current_identity()
+            if identity is None or (role is not None and identity.role != role):
+                return redirect(url_for(LOGIN_PAGES.get(role, 'main.home')))
+            g.identity = identity
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
+
+def require_teaching(class_id, term_id=None):
+    # 403 unless the signed-in teacher teaches the class in the term, the
+    # active one by default: a closed term's grades are final, and
+    # archive_term may be moving them
+    teaches = db.session.query(TeacherClass.class_id)\
+        .filter_by(teacher_id=g.identity.id, class_id=class_id)\
+        .filter(in_term(class_id, term_id)).first()
+    if not teaches:
+        abort(403, "only classes you teach this term")
+
+# conditional GET: pages built from versioned data carry an ETag and
+# Last-Modified and answer 304 without rendering when the browser's copy
+# is current. Shared table fragments are rendered once per version.
+FRAGMENT_CACHE_SIZE = 20000
+
+fragments = LRUCache(FRAGMENT_CACHE_SIZE)
+
+def fragment(key, render):
+    # key must include the version of everything the fragment shows
+    markup = fragments.get(key)
+    if markup is None:
+        markup = render()
+        fragments.put(key, markup)
+    return markup
+
+def page_version(app):
+    # templates change on deploy, so they are part of every ETag
+    folder = os.path.join(app.root_path, app.template_folder)
+    return int(max(entry.stat().st_mtime for entry in os.scandir(folder)))
+
+def conditional_page(parts, versions, render):
+    # parts identify the page and its data; versions are the
+    # (version, changed_at) pairs from entity_versions
+    if session.get('_flashes'):
+        # a one-off message is part of the page
+        return render()
+    etag = hashlib.blake2b(repr((current_app.config['PAGE_VERSION'], parts)).encode(),
+                           digest_size=12).hexdigest()
+    changed = [changed_at for _, changed_at in versions if changed_at is not None]
+    last_modified = datetime.fromtimestamp(max(changed), timezone.utc) if changed else None
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response(render())
+    else:
+        response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # per user, and always checked with the server before reuse
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
 # Flask-Admin setup
+# list pages on large tables: counts are cached for a while instead of
+# run on every page load, only indexed columns sort and filter, and the
+# last key of each page served is kept so the next page is a keyset
+# seek instead of an OFFSET scan
+ADMIN_LIST_CACHE_SIZE = 1000
+ADMIN_COUNT_TTL = 30  # seconds
+ADMIN_PAGE_TTL = 300  # seconds
+BULK_MAX_STUDENTS = 5000
+
+admin_counts = LRUCache(ADMIN_LIST_CACHE_SIZE, ADMIN_COUNT_TTL)
+admin_pages = LRUCache(ADMIN_LIST_CACHE_SIZE, ADMIN_PAGE_TTL)
+
 class SecureModelView(ModelView):
+    list_template = 'Admin_Model_List.html'
+    # (label, endpoint) buttons next to Create on the list page
+    bulk_links = ()
+
     def is_accessible(self):
-        print("Role in session:", session.get('role'))  # Debugging print
         return session.get('role') == 'admin'
 
     def inaccessible_callback(self, name, **kwargs):
-        print("Inaccessible callback triggered")  # Debugging print
-        return redirect(url_for('admin_login'))
+        return redirect(url_for('main.admin_login'))
+
+    def list_count(self, key, count_query):
+        count = admin_counts.get(key)
+        if count is None:
+            count = count_query.scalar()
+            admin_counts.put(key, count)
+        return count
+
+    def page_keys(self, sort_column):
+        # (attribute, column) pairs the list is ordered by: the sort
+        # column, then the primary key to make the order total
+        mapper = inspect(self.model)
+        keys = []
+        if sort_column in self._sortable_columns:
+            attr = self._sortable_columns[sort_column]
+            keys.append((attr.key, attr))
+        for pk in mapper.primary_key:
+            name = mapper.get_property_by_column(pk).key
+            if name not in dict(keys):
+                keys.append((name, getattr(self.model, name)))
+        return keys
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        if page_size is None:
+            page_size = self.page_size
+        filters = tuple(filters or ())
+        joins, count_joins = {}, {}
+        query = self.get_query()
+        count_query = self.get_count_query()
+        if self._search_supported and search:
+            query, count_query, joins, count_joins = self._apply_search(
+                query, count_query, joins, count_joins, search)
+        if filters and self._filters:
+            query, count_query, joins, count_joins = self._apply_filters(
+                query, count_query, joins, count_joins, filters)
+        count = self.list_count((self.endpoint, search, filters), count_query)
+
+        for j in self._auto_joins:
+            query = query.options(joinedload(j))
+        keys = self.page_keys(sort_column)
+        columns = [column for _, column in keys]
+        query = query.order_by(*(desc(column) if sort_desc else column for column in columns))
+
+        # a page seeks past the last row of the one before it, which is only
+        # known once that page was listed: "next" seeks, while jumping ahead
+        # in the pager or following an old link falls back to OFFSET
+        page_key = (self.endpoint, sort_column, sort_desc, search, filters, page_size)
+        after = admin_pages.get(page_key + (page,)) if page else None
+        if after is not None:
+            position = tuple_(*columns)
+            query = query.filter(position < after if sort_desc else position > after)
+        elif page and page_size:
+            query = query.offset(page * page_size)
+        if page_size:
+            query = query.limit(page_size)
+        if not execute:
+            return count, query
+
+        rows = query.all()
+        if page_size and len(rows) == page_size:
+            last = rows[-1]
+            admin_pages.put(page_key + ((page or 0) + 1,), tuple(getattr(last, name) for name, _ in keys))
+        return count, rows
+
+    def create_model(self, form):
+        model = super().create_model(form)
+        if model:
+            admin_lists_changed()
+        return model
+
+    def delete_model(self, model):
+        deleted = super().delete_model(model)
+        if deleted:
+            admin_lists_changed()
+        return deleted
+
+def admin_lists_changed():
+    admin_counts.invalidate()
+    admin_pages.invalidate()
+
+def student_list(text_):
+    # uni ids one per line or separated by commas or semicolons, in the
+    # order given, without repeats; uni ids may contain spaces
+    entries = (entry.strip() for entry in re.split(r'[\r\n,;]+', text_ or ''))
+    return list(dict.fromkeys(entry for entry in entries if entry))
+
+def class_id_list(text_):
+    return list(dict.fromkeys(int(value) for value in re.findall(r'\d+', text_ or '')))
+
+# bulk changes are one set-based statement each, in one transaction,
+# then the waitlist is promoted and the catalog told once
+def bulk_enroll(class_id, uni_ids):
+    # enrolls the listed students in list order while seats last;
+    # returns (enrolled, already enrolled, not students, no seat)
+    enrolled_here = select(Enrollment.student_id)\
+        .where(Enrollment.student_id == User.id, Enrollment.class_id == class_id)\
+        .exists()
+    found = db.session.execute(
+        select(User.id, enrolled_here)
+        .where(User.uni_id.in_(uni_ids), User.role == 'student')
+    ).all()
+    already = sum(1 for _, is_enrolled in found if is_enrolled)
+
+    roster = values(column('uni_id', String), column('position', Integer), name='roster')\
+        .data([(uni_id, position) for position, uni_id in enumerate(uni_ids)])\
+        .cte('roster')  # SQLite only takes VALUES column names on a CTE
+    seats_taken = select(func.count())\
+        .select_from(Enrollment)\
+        .where(Enrollment.class_id == class_id)\
+        .scalar_subquery()
+    candidates = select(
+        User.id.label('student_id'),
+        func.row_number().over(order_by=roster.c.position).label('place'),
+    ).join(roster, roster.c.uni_id == User.uni_id)\
+        .where(User.role == 'student', ~enrolled_here)\
+        .subquery()
+    # the roster CTE goes in front of INSERT, where the driver reports no
+    # rowcount, so the new rows are counted off RETURNING
+    enrolled = len(db.session.execute(
+        insert(Enrollment).from_select(
+            ['student_id', 'class_id'],
+            select(candidates.c.student_id, literal(class_id))
+            .where(in_term(class_id), candidates.c.place <= seat_limit(class_id) - seats_taken),
+        ).returning(Enrollment.student_id)
+    ).all())
+    db.session.commit()
+    catalog.invalidate(class_id)
+    admin_lists_changed()
+    return enrolled, already, len(uni_ids) - len(found), len(found) - already - enrolled
+
+def drop_enrollments(where, class_ids):
+    dropped = db.session.execute(delete(Enrollment).where(where)).rowcount
+    if dropped:
+        promote_waitlist(class_ids)
+    db.session.commit()
+    catalog.invalidate(*class_ids)
+    admin_lists_changed()
+    return dropped
+
+def set_max_seats(class_ids, max_seats):
+    # every section of the classes; more seats go to the waitlist
+    updated = db.session.execute(
+        update(TeacherClass)
+        .where(TeacherClass.class_id.in_(class_ids))
+        .values(max_seats=max_seats)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    promote_waitlist(class_ids)
+    db.session.commit()
+    catalog.invalidate(*class_ids)
+    return updated
+
+# admin writes to these models change what the course catalog shows
+class CatalogModelView(SecureModelView):
+    def catalog_class_ids(self, model):
+        # the class the row belongs to now and before this edit
+        history = inspect(model).attrs.class_id.history
+        return set(history.added) | set(history.unchanged) | set(history.deleted)
+
+    def on_model_change(self, form, model, is_created):
+        model._catalog_class_ids = self.catalog_class_ids(model)
 
-class TeacherClassModelView(SecureModelView):
+    def after_model_change(self, form, model, is_created):
+        catalog.invalidate(*getattr(model, '_catalog_class_ids', {model.class_id}))
+
+    def after_model_delete(self, model):
+        catalog.invalidate(model.class_id)
+
+class TeacherClassModelView(CatalogModelView):
     form_columns = ['teacher_id', 'class_id', 'day', 'time', 'max_seats']
-class GradeModelView(SecureModelView):
+    # foreign keys aren't listed by default, and only listed columns sort
+    column_list = ['teacher_id', 'class_id', 'day', 'time', 'max_seats']
+    # the primary key and ix_teacher_class_class
+    column_sortable_list = ['teacher_id', 'class_id']
+    column_filters = [IntEqualFilter(TeacherClass.teacher_id, 'Teacher ID'),
+                      IntEqualFilter(TeacherClass.class_id, 'Class ID')]
+    bulk_links = (('Bulk max seats', '.bulk_seats_view'),)
+
+    def on_model_change(self, form, model, is_created):
+        super().on_model_change(form, model, is_created)
+        # more seats go to the waitlist before the edit is committed
+        promote_waitlist(model._catalog_class_ids)
+
+    @action('set_max_seats', 'Set max seats')
+    def action_set_max_seats(self, ids):
+        class_ids = sorted({int(iterdecode(id_)[1]) for id_ in ids})
+        return redirect(self.get_url('.bulk_seats_view', class_ids=','.join(map(str, class_ids))))
+
+    @expose('/bulk-seats/', methods=('GET', 'POST'))
+    def bulk_seats_view(self):
+        class_ids = request.values.get('class_ids', '')
+        if request.method == 'POST':
+            max_seats = request.form.get('max_seats', type=int)
+            ids = class_id_list(class_ids)
+            if not ids or max_seats is None or max_seats < 0:
+                flash('Give at least one class id and a max seats of 0 or more.', 'error')
+            else:
+                updated = set_max_seats(ids, max_seats)
+                flash(f'{updated} section(s) now have {max_seats} seats.', 'success')
+                return redirect(self.get_url('.index_view'))
+        return self.render('Admin_Bulk_Seats.html', class_ids=class_ids)
+class GradeModelView(CatalogModelView):
     form_columns = ['student_id', 'class_id', 'grade']
+    column_list = ['student_id', 'class_id', 'grade']
+    # the primary key and ix_enrollment_class
+    column_sortable_list = ['student_id', 'class_id']
+    column_filters = [IntEqualFilter(Enrollment.student_id, 'Student ID'),
+                      IntInListFilter(Enrollment.student_id, 'Student ID'),
+                      IntEqualFilter(Enrollment.class_id, 'Class ID'),
+                      IntInListFilter(Enrollment.class_id, 'Class ID')]
+    bulk_links = (('Bulk enroll / drop', '.bulk_enrollment_view'),)
+
+    def after_model_delete(self, model):
+        promote_waitlist([model.class_id])
+        db.session.commit()
+        super().after_model_delete(model)
+
+    @action('delete', 'Drop', 'Drop the selected enrollments?')
+    def action_delete(self, ids):
+        pairs = [tuple(int(value) for value in iterdecode(id_)) for id_ in ids]
+        class_ids = {class_id for _, class_id in pairs}
+        dropped = drop_enrollments(tuple_(Enrollment.student_id, Enrollment.class_id).in_(pairs), class_ids)
+        flash(f'{dropped} enrollment(s) dropped.', 'success')
+
+    @expose('/bulk/', methods=('GET', 'POST'))
+    def bulk_enrollment_view(self):
+        class_id = request.form.get('class_id', type=int)
+        students = request.form.get('students', '')
+        if request.method == 'POST':
+            uni_ids = student_list(students)
+            if class_id is None or not uni_ids:
+                flash('Give a class id and at least one student.', 'error')
+            elif len(uni_ids) > BULK_MAX_STUDENTS:
+                flash(f'At most {BULK_MAX_STUDENTS} students at a time.', 'error')
+            elif not db.session.scalar(select(in_term(class_id))):
+                # past terms are history, and enrolling would report every
+                # student as without a seat
+                flash(f'Class {class_id} is not offered in the active term.', 'error')
+            elif request.form.get('operation') == 'drop':
+                listed = select(User.id).where(User.uni_id.in_(uni_ids))
+                dropped = drop_enrollments(
+                    and_(Enrollment.class_id == class_id, Enrollment.student_id.in_(listed)), [class_id])
+                flash(f'{dropped} student(s) dropped from class {class_id}.', 'success')
+                return redirect(self.get_url('.index_view'))
+            else:
+                enrolled, already, unknown, no_seat = bulk_enroll(class_id, uni_ids)
+                flash(f'{enrolled} enrolled in class {class_id}, {already} already enrolled, '
+                      f'{unknown} not students, {no_seat} without a seat.',
+                      'success' if enrolled else 'warning')
+                return redirect(self.get_url('.index_view'))
+        return self.render('Admin_Bulk_Enrollment.html', class_id=class_id, students=students)
+class ClassModelView(SecureModelView):
+    column_display_pk = True
+    column_sortable_list = ['id']
+    column_filters = [IntEqualFilter(Class.term_id, 'Term ID')]
+    # searched through the full text index rather than LIKE over every row
+    column_searchable_list = ['name']
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        expression = match_expression(search)
+        if expression is None:
+            return query, count_query, joins, count_joins
+        matches = text("SELECT rowid FROM class_search WHERE class_search MATCH :match")\
+            .bindparams(match=expression)\
+            .columns(column('rowid', Integer))
+        query = query.filter(Class.id.in_(matches))
+        if count_query is not None:
+            count_query = count_query.filter(Class.id.in_(matches))
+        return query, count_query, joins, count_joins
+
+    def after_model_change(self, form, model, is_created):
+        catalog.invalidate(model.id)
+
+    def after_model_delete(self, model):
+        catalog.invalidate(model.id)
+class TermModelView(SecureModelView):
+    # terms are started and archived with flask start-term / archive-term
+    can_create = False
+    can_delete = False
+    form_columns = ['name']
+
 class UserModelView(SecureModelView):
     form_columns = ['id', 'uni_id','password','role']
+    column_display_pk = True
+    column_sortable_list = ['id', 'uni_id']
+    column_filters = [FilterEqual(User.uni_id, 'Uni ID')]
+
+    def on_model_change(self, form, model, is_created):
+        # a new name, password or role signs the account out everywhere
+        state = inspect(model)
+        if not is_created and any(state.attrs[name].history.has_changes()
+                                  for name in ('id', 'uni_id', 'password', 'role')):
+            model.session_version = (model.session_version or 0) + 1
+
+    def after_model_change(self, form, model, is_created):
+        identities.invalidate(model.id)
+
+    def after_model_delete(self, model):
+        identities.invalidate(model.id)
     
 class SecureAdminIndexView(AdminIndexView):
     @expose('/')
     def index(self):
         if session.get('role') != 'admin':
-            return redirect(url_for('admin_login'))
+            return redirect(url_for('main.admin_login'))
         return super().index()
 
 # Flask-Admin setup
-admin = Admin(app, name='School Admin', template_mode='bootstrap3',
+admin = Admin(name='School Admin', template_mode='bootstrap3',
               index_view=SecureAdminIndexView(url='/admin/'))
 admin.add_view(UserModelView(User, db.session))
-admin.add_view(SecureModelView(Class, db.session))
+admin.add_view(ClassModelView(Class, db.session))
 admin.add_view(GradeModelView(Enrollment, db.session))
 admin.add_view(TeacherClassModelView(TeacherClass, db.session))
+admin.add_view(TermModelView(Term, db.session))
 
 # Routes
-@app.route('/')
+@bp.route('/')
 def home():
     return render_template('Home.html')
 
-@app.route('/admin_login', methods=['GET', 'POST'])
+@bp.route('/admin_login', methods=['GET', 'POST'])
 def admin_login():
     if request.method == 'POST':
         username = request.form['username']
@@ -114,7 +1862,7 @@ def admin_login():
         return render_template('Admin_Login_Page.html', error='Invalid credentials')
     return render_template('Admin_Login_Page.html')
 
-@app.route('/student-registration', methods=['GET', 'POST'])
+@bp.route('/student-registration', methods=['GET', 'POST'])
 def student_registration():
     if request.method == 'POST':
         uni_id = request.form.get("uni_id")
@@ -127,11 +1875,11 @@ def student_registration():
         new_student = User(uni_id=uni_id, password=password, role='student')
         db.session.add(new_student)
         db.session.commit()
-        return redirect(url_for('student_login'))
+        return redirect(url_for('main.student_login'))
 
     return render_template('Student_Registration_Page.html')
 
-@app.route('/student-login', methods=['GET', 'POST'])
+@bp.route('/student-login', methods=['GET', 'POST'])
 def student_login():
     if request.method == 'POST':
         uni_id = request.form.get("username")
@@ -144,14 +1892,14 @@ def student_login():
         elif user.password != password:
             error = "Incorrect password."
         else:
-            session['uni_id'] = uni_id
-            return redirect(url_for('student_view_courses'))
+            sign_in(user)
+            return redirect(url_for('main.student_view_courses'))
 
         return render_template('Student_Login_Page.html', error=error)
 
     return render_template('Student_Login_Page.html')
 
-@app.route('/forgot-password/<role>', methods=['GET', 'POST'])
+@bp.route('/forgot-password/<role>', methods=['GET', 'POST'])
 def forgot_password(role):
     message = ""
     if request.method == 'POST':
@@ -166,125 +1914,470 @@ def forgot_password(role):
     return render_template('Forgot_Password_Page.html', message=message, role=role)
 
 
-@app.route('/student-view-courses')
+@bp.route('/student-view-courses')
+@login_required(role='student')
 def student_view_courses():
-    uni_id = session.get('uni_id')
-    if not uni_id:
-        return redirect(url_for('student_login'))
-
-    student = User.query.filter_by(uni_id=uni_id, role='student').first()
-    if not student:
-        return redirect(url_for('student_login'))
-
-    enrolled_classes = Class.query\
-        .join(Enrollment, Class.id == Enrollment.class_id)\
-        .filter(Enrollment.student_id == student.id)\
+    student = g.identity
+
+    # teacher, time and seat counts come from the catalog rows rather than
+    # lazy loads of each class's teachers and students
+    courses = [{
+        "name": row["name"],
+        "teacher_name": row["teacher_name"],
+        "time": row["time"],
+        "student_count": row["student_count"],
+        "max_seats": row["max_seats"],
+    } for row in catalog.get_many(sorted(enrolled_class_ids(student.id))) if row]
+
+    return render_template('Student_View_Courses.html', student_name=student.uni_id, courses=courses)
+
+
+@bp.route('/student-transcript')
+@login_required(role='student')
+def student_transcript():
+    student = g.identity
+
+    # grades with each class's running average, and the GPA totals;
+    # terms not yet archived come from the hot tables, the rest from
+    # the archive with the class average it had when archived
+    rows = db.session.query(Term.id, Term.name, Class.name, Enrollment.grade, ClassGradeStats)\
+        .join(Class, Class.term_id == Term.id)\
+        .join(Enrollment, Enrollment.class_id == Class.id)\
+        .outerjoin(ClassGradeStats, ClassGradeStats.class_id == Class.id)\
+        .filter(Enrollment.student_id == student.id)
+    courses = [{"term_id": term_id, "term": term, "name": name, "grade": grade,
+                "class_average": stats.mean if stats else None}
+               for term_id, term, name, grade, stats in rows]
+    stats = db.session.get(StudentGradeStats, student.id)
+    grade_count = stats.grade_count if stats else 0
+    grade_sum = stats.grade_sum if stats else 0.0
+    grade_points = stats.grade_points if stats else 0.0
+
+    archived = db.session.query(ArchivedEnrollment.term_id, ArchivedEnrollment.class_name,
+                                ArchivedEnrollment.grade, ArchivedEnrollment.grade_points,
+                                ArchivedEnrollment.class_average)\
+        .filter(ArchivedEnrollment.student_id == student.id)\
         .all()
-
-    courses = []
-    for class_ in enrolled_classes:
-        teacher_info = class_.teachers[0] if class_.teachers else None
-
-        teacher_name = teacher_info.teacher.uni_id if teacher_info else "TBA"
-        class_time = f"{teacher_info.time}" if teacher_info else "TBD"
-
-        max_seats = teacher_info.max_seats if teacher_info else 30  # Default fallback value
-
-        student_count = len(class_.students)
-
-        courses.append({
-            "name": class_.name,
-            "teacher_name": teacher_name,
-            "time": class_time,
-            "student_count": student_count,
-            "max_seats": max_seats  # Ensure this is included in the dictionary
-        })
-
-    return render_template('student_view_courses.html', student_name=student.uni_id, courses=courses)
-
-
-@app.route('/student-add-courses')
+    if archived:
+        terms = dict(db.session.query(Term.id, Term.name).filter(Term.id.in_({row.term_id for row in archived})))
+        for term_id, name, grade, points, class_average in archived:
+            courses.append({"term_id": term_id, "term": terms.get(term_id, ''), "name": name,
+                            "grade": grade, "class_average": class_average})
+            if grade is not None:
+                grade_count += 1
+                grade_sum += grade
+                grade_points += points
+    courses.sort(key=lambda course: (course["term_id"], course["name"]))
+
+    return render_template('Student_Transcript.html', student_name=student.uni_id, courses=courses,
+                           gpa=grade_points / grade_count if grade_count else None,
+                           average=grade_sum / grade_count if grade_count else None)
+
+
+@bp.route('/student-add-courses')
+@login_required(role='student')
 def student_add_courses():
-    uni_id = session.get('uni_id')
-    if not uni_id:
-        return redirect(url_for('student_login'))
+    student = g.identity
+    versions = entity_versions([('catalog', 0), ('student', student.id)])
+    return conditional_page((student, request.full_path, sorted(versions.items())), versions.values(),
+                            lambda: render_add_courses(student))
+
+def render_add_courses(student):
+    enrolled = enrolled_class_ids(student.id)
+
+    # shared catalog rows come from the cache, enrollment is per student
+    query = request.args.get('q', '').strip()
+    fits_only = request.args.get('fits') == '1' and not query
+    if query:
+        rows, next_cursor = search_page(query, request.args.get('after'), CATALOG_PAGE_SIZE)
+    else:
+        rows = sections_fitting(enrolled) if fits_only else catalog.rows()
+        rows, next_cursor = catalog_page(rows, request.args.get('after'), CATALOG_PAGE_SIZE)
+    positions = waitlist_positions(student.id)
+    # the shared cells of a row are rendered once per class version
+    catalog_cells = get_template_attribute("Table_Fragments.html", "catalog_cells")
+    courses = [dict(row, is_enrolled=row["id"] in enrolled, waitlist_position=positions.get(row["id"]),
+                    cells=fragment(("catalog_row", row["id"], row["version"]), lambda: catalog_cells(row)))
+               for row in rows]
+
+    return render_template("Student_Add_Courses.html", student_name=student.uni_id, courses=courses,
+                           fits_only=fits_only, query=query, next_cursor=next_cursor,
+                           ticket=request.args.get('ticket', type=int))
+
+# keyset pagination: the cursor is the last class id shown, or
+# 'score:id' for ranked search results
+CATALOG_PAGE_SIZE = 50
+SEARCH_LIMIT_MAX = 100
+AUTOCOMPLETE_LIMIT = 10
+
+def catalog_page(rows, after, limit):
+    # rows are in class id order
+    start = 0
+    if after:
+        try:
+            start = bisect_right(rows, int(after), key=lambda row: row["id"])
+        except ValueError:
+            abort(400)
+    page = rows[start:start + limit]
+    next_cursor = str(page[-1]["id"]) if start + limit < len(rows) else None
+    return page, next_cursor
+
+def search_page(query, after, limit):
+    if after:
+        try:
+            score, class_id = after.rsplit(':', 1)
+            after = (float(score), int(class_id))
+        except ValueError:
+            abort(400)
+    matches = search_class_ids(query, limit + 1, after=after)
+    next_cursor = None
+    if len(matches) > limit:
+        matches = matches[:limit]
+        next_cursor = f'{matches[-1].score!r}:{matches[-1].id}'
+    rows = catalog.get_many([class_id for class_id, _ in matches])
+    return [row for row in rows if row], next_cursor
+
+@bp.route('/courses/search')
+def course_search():
+    limit = min(request.args.get('limit', CATALOG_PAGE_SIZE, type=int), SEARCH_LIMIT_MAX)
+    rows, next_cursor = search_page(request.args.get('q', ''), request.args.get('after'), max(limit, 1))
+    return jsonify({
+        "results": [{key: row[key] for key in ("id", "name", "teacher_name", "time",
+                                                 "student_count", "max_seats", "is_full")}
+                    for row in rows],
+        "next": next_cursor,
+    })
+
+@bp.route('/courses/autocomplete')
+def course_autocomplete():
+    # class names only, best match first
+    matches = search_class_ids(request.args.get('q', ''), AUTOCOMPLETE_LIMIT, column='name')
+    rows = catalog.get_many([class_id for class_id, _ in matches])
+    return jsonify([{"id": row["id"], "name": row["name"]} for row in rows if row])
+
+# registration worker pool: each batch is claimed, applied and marked
+# done in one transaction, so a crash leaves its requests pending and
+# batches are applied one after another in arrival order
+REGISTRATION_POLL_INTERVAL = 0.05
+
+REGISTRATION_MESSAGES = {
+    'enrolled': "You are enrolled.",
+    'already_enrolled': "You are already enrolled in that class.",
+    'full': "That class is full.",
+    'conflict': "That class meets at the same time as one of your classes.",
+    'no_such_class': "That class does not exist.",
+    'unenrolled': "You have been removed from the class.",
+    'not_enrolled': "You were not enrolled in that class.",
+}
+
+def apply_registration(request_):
+    # runs inside the batch transaction, returns the result
+    student_id, class_id = request_.student_id, request_.class_id
+    if request_.action == 'unenroll':
+        removed = Enrollment.query.filter_by(student_id=student_id, class_id=class_id)\
+            .filter(in_term(class_id)).delete(synchronize_session=False)
+        if not removed:
+            return 'not_enrolled'
+        promote_waitlist([class_id])
+        return 'unenrolled'
+    params = {'student_id': student_id, 'class_id': class_id}
+    if db.session.execute(admission_statement(), params).rowcount == 1:
+        return 'enrolled'
+    return admission_failure(student_id, class_id)
+
+def process_registration_batch(worker_id, batch_size):
+    # returns how many requests were applied
+    claim_tag = f'{worker_id}:{uuid.uuid4().hex[:8]}'
+    for attempt in range(RESERVE_RETRIES):
+        try:
+            # claiming first makes the batch transaction a write from the
+            # start, so it reads the queue as of the previous batch's commit
+            oldest = select(RegistrationRequest.id)\
+                .where(RegistrationRequest.status == 'pending')\
+                .order_by(RegistrationRequest.id)\
+                .limit(batch_size)
+            db.session.execute(update(RegistrationRequest)
+                               .where(RegistrationRequest.id.in_(oldest))
+                               .values(claimed_by=claim_tag),
+                               execution_options={'synchronize_session': False})
+            batch = RegistrationRequest.query\
+                .filter_by(claimed_by=claim_tag, status='pending')\
+                .order_by(RegistrationRequest.id)\
+                .all()
+            touched = set()
+            for request_ in batch:
+                request_.result = apply_registration(request_)
+                request_.status = 'done'
+                touched.add(request_.class_id)
+            db.session.commit()
+        except OperationalError as e:
+            db.session.rollback()
+            if 'locked' not in str(e.orig) or attempt == RESERVE_RETRIES - 1:
+                raise
+            time.sleep(RESERVE_BACKOFF * (2 ** attempt))
+            continue
+        if touched:
+            catalog.invalidate(*touched)
+        return len(batch)
+    return 0
+
+class RegistrationWorkers:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._threads = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    def ensure_started(self, flask_app):
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for i in range(flask_app.config['REGISTRATION_WORKERS']):
+                thread = threading.Thread(target=self.run, args=(flask_app, f'{os.getpid()}-{i}'),
+                                          name=f'registration-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def notify(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join()
+
+    def run(self, flask_app, worker_id):
+        batch_size = flask_app.config['REGISTRATION_BATCH_SIZE']
+        while not self._stop.is_set():
+            try:
+                with flask_app.app_context():
+                    applied = process_registration_batch(worker_id, batch_size)
+            except Exception:
+                flask_app.logger.exception('registration worker %s failed a batch', worker_id)
+                applied = 0
+            if not applied:
+                self._wake.wait(REGISTRATION_POLL_INTERVAL)
+                self._wake.clear()
+
+registration_workers = RegistrationWorkers()
+
+class TicketWriter:
+    # group commit for the tickets: requests that arrive while a commit is
+    # under way wait for the next one, which writes them all, instead of
+    # each queueing for the write lock with a commit of its own
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []         # (row, slot) for the next commit
+        self._writing = False
+
+    def write(self, row):
+        # returns the new request id
+        slot = {'done': threading.Event()}
+        with self._lock:
+            self._pending.append((row, slot))
+            lead = not self._writing
+            self._writing = True
+        if not lead:
+            slot['done'].wait()
+            if not slot.pop('lead', False):
+                return self._result(slot)
+        self._commit_pending()
+        return self._result(slot)
+
+    def _commit_pending(self):
+        with self._lock:
+            group, self._pending = self._pending, []
+        stmt = insert(RegistrationRequest.__table__)\
+            .returning(RegistrationRequest.id, sort_by_parameter_order=True)
+        try:
+            ids = db.session.scalars(stmt, [row for row, _ in group]).all()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            results = [('error', e)] * len(group)
+        else:
+            results = [('id', ticket) for ticket in ids]
+        with self._lock:
+            # whoever arrived meanwhile commits next, led by the first of them
+            if self._pending:
+                self._pending[0][1]['lead'] = True
+                self._pending[0][1]['done'].set()
+            else:
+                self._writing = False
+        for (_, slot), (key, value) in zip(group, results):
+            slot[key] = value
+            slot['done'].set()
+
+    @staticmethod
+    def _result(slot):
+        slot['done'].wait()
+        if 'error' in slot:
+            raise slot['error']
+        return slot['id']
+
+def queue_registration(student_id, class_id, action):
+    # one writer per app, so its rows go to that app's database
+    writer = current_app.extensions.setdefault('registration_tickets', TicketWriter())
+    ticket = writer.write({'student_id': student_id, 'class_id': class_id,
+                           'action': action, 'status': 'pending'})
+    registration_workers.ensure_started(current_app._get_current_object())
+    registration_workers.notify()
+    return ticket
+
+def queued_response(ticket):
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({"ticket": ticket,
+                        "status_url": url_for('main.registration_status', ticket=ticket)}), 202
+    return redirect(url_for('main.student_add_courses', ticket=ticket))
+
+@bp.route('/registration/<int:ticket>')
+@login_required(role='student')
+def registration_status(ticket):
+    request_ = db.session.get(RegistrationRequest, ticket)
+    if request_ is None or request_.student_id != g.identity.id:
+        abort(404)
+    if request_.status == 'pending' and current_app.config['REGISTRATION_MODE'] == 'queued':
+        registration_workers.ensure_started(current_app._get_current_object())
+
+    return jsonify({
+        "ticket": request_.id,
+        "action": request_.action,
+        "class_id": request_.class_id,
+        "status": request_.status,
+        "result": request_.result,
+        "message": REGISTRATION_MESSAGES.get(request_.result),
+    })
+
+@bp.cli.command('registration-worker')
+def registration_worker_command():
+    # a dedicated worker process; web processes can then run with
+    # REGISTRATION_WORKERS=0
+    registration_workers.ensure_started(current_app._get_current_object())
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        registration_workers.stop()
+
+def clock_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    minutes = schedule.parse_clock(value)
+    if minutes is None:
+        abort(400)
+    return minutes
+
+@bp.route('/sections/fits-my-schedule')
+@login_required(role='student')
+def sections_fitting_schedule():
+    student = g.identity
+
+    days = request.args.get('days')
+    days_mask = schedule.parse_days(days) if days else None
+    start_after = clock_arg('start_after')
+    end_before = clock_arg('end_before')
+
+    sections = sections_fitting(enrolled_class_ids(student.id), days_mask, start_after, end_before)
+    return jsonify([{
+        "id": row["id"],
+        "name": row["name"],
+        "teacher_name": row["teacher_name"],
+        "time": row["time"],
+        "days": [schedule.WEEKDAYS[day] for day in schedule.weekdays(row["meeting"][0])],
+        "start": schedule.format_minutes(row["meeting"][1]),
+        "end": schedule.format_minutes(row["meeting"][2]),
+        "student_count": row["student_count"],
+        "max_seats": row["max_seats"],
+    } for row in sections])
+
+
+
+@bp.route('/enroll/<int:course_id>')
+@login_required(role='student')
+def enroll(course_id):
+    student = g.identity
 
-    student = User.query.filter_by(uni_id=uni_id, role='student').first()
-    if not student:
-        return redirect(url_for('student_login')) 
+    if current_app.config['REGISTRATION_MODE'] == 'queued':
+        return queued_response(queue_registration(student.id, course_id, 'enroll'))
 
-    enrolled_class_ids = [enrollment.class_id for enrollment in student.student_classes]
+    conflicts = schedule_conflicts(student.id, course_id)
+    if conflicts:
+        flash(f"That class meets at the same time as {', '.join(conflicts)}.")
+        return redirect(url_for('main.student_add_courses'))
 
-    all_classes = Class.query.all()
-    courses = []
+    status = reserve_seat(student.id, course_id)
+    if status == 'no_such_class':
+        abort(404)
+    if status == 'full':
+        flash("That class is full.")
+    if status == 'conflict':
+        # a clashing class was added since the check above
+        flash(REGISTRATION_MESSAGES['conflict'])
 
-    for class_ in all_classes:
-        teacher_info = class_.teachers[0] if class_.teachers else None
+    return redirect(url_for('main.student_add_courses'))
 
-        # Dynamically fetch the teacher's information
-        teacher_name = teacher_info.teacher.uni_id if teacher_info else "TBA"
-        class_time = f"{teacher_info.time}" if teacher_info else "TBD"
-
-        # Dynamically fetch max_seats from TeacherClass (if a teacher exists for the class)
-        max_seats = teacher_info.max_seats if teacher_info else 30  # Default to 30 if no teacher
+@bp.route('/unenroll/<int:course_id>')
+@login_required(role='student')
+def unenroll(course_id):
+    student = g.identity
 
-        student_count = len(class_.students)
-        is_enrolled = class_.id in enrolled_class_ids
-        is_full = student_count >= max_seats
+    if current_app.config['REGISTRATION_MODE'] == 'queued':
+        return queued_response(queue_registration(student.id, course_id, 'unenroll'))
 
-        courses.append({
-            "id": class_.id,
-            "name": class_.name,
-            "teacher_name": teacher_name,
-            "time": class_time,
-            "student_count": student_count,
-            "is_enrolled": is_enrolled,
-            "is_full": is_full,
-            "max_seats": max_seats  # Dynamically include max_seats from TeacherClass
-        })
+    # classes of past terms are history, not something to drop
+    enrollment = Enrollment.query.filter_by(student_id=student.id, class_id=course_id)\
+        .filter(in_term(course_id)).first()
+    if enrollment:
+        db.session.delete(enrollment)
+        # the freed seat goes to the waitlist in the same transaction
+        promote_waitlist([course_id])
+        db.session.commit()
+        catalog.invalidate(course_id)
 
-    return render_template("Student_Add_Courses.html", student_name=student.uni_id, courses=courses)
+    return redirect(url_for('main.student_add_courses'))
 
+@bp.route('/waitlist/<int:course_id>')
+@login_required(role='student')
+def waitlist(course_id):
+    student = g.identity
 
+    conflicts = schedule_conflicts(student.id, course_id)
+    if conflicts:
+        flash(f"That class meets at the same time as {', '.join(conflicts)}.")
+        return redirect(url_for('main.student_add_courses'))
 
-@app.route('/enroll/<int:course_id>')
-def enroll(course_id):
-    if 'uni_id' not in session:
-        return redirect(url_for('student_login'))
+    status = join_waitlist(student.id, course_id)
+    if status == 'no_such_class':
+        abort(404)
+    if status == 'conflict':
+        flash(REGISTRATION_MESSAGES['conflict'])
+    if status == 'waitlisted':
+        flash("You have been added to the waitlist.")
 
-    student = User.query.filter_by(uni_id=session['uni_id']).first()
+    return redirect(url_for('main.student_add_courses'))
 
-    existing = Enrollment.query.filter_by(student_id=student.id, class_id=course_id).first()
-    if existing:
-        return redirect(url_for('student_add_courses'))
+@bp.route('/leave-waitlist/<int:course_id>')
+@login_required(role='student')
+def leave_waitlist(course_id):
+    student = g.identity
 
-    new_enrollment = Enrollment(student_id=student.id, class_id=course_id, grade=0.00)
-    db.session.add(new_enrollment)
+    Waitlist.query.filter_by(student_id=student.id, class_id=course_id).delete()
     db.session.commit()
 
-    return redirect(url_for('student_add_courses'))
+    return redirect(url_for('main.student_add_courses'))
 
-@app.route('/unenroll/<int:course_id>')
-def unenroll(course_id):
-    if 'uni_id' not in session:
-        return redirect(url_for('student_login'))
-
-    student = User.query.filter_by(uni_id=session['uni_id']).first()
-
-    enrollment = Enrollment.query.filter_by(student_id=student.id, class_id=course_id).first()
-    if enrollment:
-        db.session.delete(enrollment)
-        db.session.commit()
-
-    return redirect(url_for('student_add_courses'))
-
-@app.route('/users')
+@bp.route('/users')
 def show_users():
     users = User.query.all()
     return render_template('Users.html', users=users)
 
 # For Teacher Registration
-@app.route('/teacher-registration', methods=['GET', 'POST'])
+@bp.route('/teacher-registration', methods=['GET', 'POST'])
 def teacher_registration():
     if request.method == 'POST':
         uni_id = request.form.get("uni_id")  
@@ -299,12 +2392,12 @@ def teacher_registration():
         new_teacher = User(uni_id=uni_id, password=password, role='teacher')
         db.session.add(new_teacher)
         db.session.commit()
-        return redirect(url_for('teacher_login'))  # Redirect to login after success
+        return redirect(url_for('main.teacher_login'))  # Redirect to login after success
     
     return render_template('Teacher_Registration_Page.html')
 
 # To make the teacher login run
-@app.route('/teacher-login', methods = ['GET', 'POST'])
+@bp.route('/teacher-login', methods = ['GET', 'POST'])
 def teacher_login():
     error = None
 
@@ -322,37 +2415,168 @@ def teacher_login():
         elif user.role != 'teacher': 
             error = "You are not authorized to access this page."
         else: 
-            session['uni_id'] = uni_id
-            return redirect(url_for('teacher_dashboard'))
+            sign_in(user)
+            return redirect(url_for('main.teacher_dashboard'))
 
         return render_template('Teacher_Login_Page.html', error=error)
 
     return render_template('Teacher_Login_Page.html')
 
 
-@app.route('/teacher-view-course/<int:class_id>')
+@bp.route('/teacher-view-course/<int:class_id>')
+@login_required(role='teacher')
 def teacher_view_course(class_id):
+    require_teaching(class_id)
+    versions = entity_versions([('class', class_id)])
+    version = versions.get(('class', class_id), (0, None))[0]
+    return conditional_page((class_id, version), versions.values(),
+                            lambda: render_roster(class_id, version=version))
 
+def render_roster(class_id, report=None, version=None):
     class_ = Class.query.get_or_404(class_id)
-
-    teacher_class = class_.teachers[0]
-    teacher = User.query.get(teacher_class.teacher_id)
-
-    # Get enrolled students and their grades
-    enrollments = Enrollment.query.filter_by(class_id=class_id).all()
-    students = []
-    for enrollment in enrollments:
-        student = User.query.get(enrollment.student_id)
-        students.append({
-            "student_id": student.id,
-            "name": student.uni_id,
-            "grade": enrollment.grade
-        })
-
-    return render_template('Teacher_View_Course.html', class_ = class_, students=students, teacher_name= teacher.uni_id)
-@app.route('/update-grade/<int:student_id>/<int:class_id>', methods=['POST'])
+    if version is None:
+        version = entity_versions([('class', class_id)]).get(('class', class_id), (0, None))[0]
+
+    teacher_name = db.session.query(User.uni_id)\
+        .join(TeacherClass, TeacherClass.teacher_id == User.id)\
+        .filter(TeacherClass.class_id == class_id)\
+        .order_by(TeacherClass.teacher_id)\
+        .limit(1)\
+        .scalar()
+
+    def render_rows():
+        # enrolled students and their grades in one joined query
+        roster = db.session.query(User.id, User.uni_id, Enrollment.grade)\
+            .join(Enrollment, Enrollment.student_id == User.id)\
+            .filter(Enrollment.class_id == class_id)\
+            .order_by(User.uni_id)
+        students = [{"student_id": student_id, "name": name, "grade": grade}
+                    for student_id, name, grade in roster]
+        roster_rows = get_template_attribute('Table_Fragments.html', 'roster_rows')
+        return {"rows": roster_rows(students), "count": len(students)}
+
+    roster = fragment(("roster", class_id, version), render_rows)
+    return render_template('Teacher_View_Course.html', class_ = class_, roster=roster,
+                           teacher_name=teacher_name or "TBA", report=report)
+
+# bulk grade entry: a whole roster is validated and written with one
+# UPDATE statement in one transaction
+GRADE_MIN = 0.0
+GRADE_MAX = 100.0
+
+def grade_rows_from_request():
+    # yields (row number, student_id, uni_id, grade) from an uploaded CSV,
+    # a JSON body or the roster form's student_id/grade arrays
+    upload = request.files.get('file')
+    if upload and upload.filename:
+        # read the upload row by row instead of loading it whole
+        reader = csv.DictReader(io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline=''))
+        for number, row in enumerate(reader, start=1):
+            yield number, row.get('student_id'), row.get('uni_id'), row.get('grade')
+    elif request.is_json:
+        payload = request.get_json(silent=True)
+        rows = payload.get('grades') if isinstance(payload, dict) else payload
+        for number, row in enumerate(rows if isinstance(rows, list) else [], start=1):
+            if not isinstance(row, dict):
+                row = {}
+            yield number, row.get('student_id'), row.get('uni_id'), row.get('grade')
+    else:
+        form_rows = zip(request.form.getlist('student_id'), request.form.getlist('grade'))
+        for number, (student_id, grade) in enumerate(form_rows, start=1):
+            yield number, student_id, None, grade
+
+def parse_grade(value):
+    # blank clears the grade
+    if value is None or str(value).strip() == '':
+        return None
+    try:
+        grade = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("grade must be a number")
+    if not GRADE_MIN <= grade <= GRADE_MAX:
+        raise ValueError(f"grade must be between {GRADE_MIN:g} and {GRADE_MAX:g}")
+    return grade
+
+def parse_student_id(value):
+    # CSV and form values are text; JSON may send a number
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError
+        return int(value)
+    if isinstance(value, (int, str)):
+        return int(value)
+    raise ValueError
+
+def apply_grades(class_id, rows):
+    # returns (rows updated, per-row errors)
+    roster = dict(db.session.query(Enrollment.student_id, User.uni_id)
+                  .join(User, User.id == Enrollment.student_id)
+                  .filter(Enrollment.class_id == class_id))
+    by_uni_id = {uni_id: student_id for student_id, uni_id in roster.items()}
+
+    grades = {}
+    errors = []
+    for number, student_id, uni_id, grade in rows:
+        def reject(message):
+            errors.append({"row": number, "student_id": student_id, "uni_id": uni_id,
+                           "error": message})
+
+        if student_id not in (None, ''):
+            try:
+                student_id = parse_student_id(student_id)
+            except ValueError:
+                reject("student_id must be a whole number")
+                continue
+        elif uni_id not in (None, ''):
+            if not isinstance(uni_id, str):
+                reject("uni_id must be text")
+                continue
+            student_id = by_uni_id.get(uni_id.strip())
+        else:
+            reject("student_id or uni_id is required")
+            continue
+        if student_id not in roster:
+            reject("student is not enrolled in this class")
+            continue
+        if student_id in grades:
+            reject("student is listed more than once")
+            continue
+        try:
+            grades[student_id] = parse_grade(grade)
+        except ValueError as e:
+            reject(str(e))
+
+    if grades:
+        db.session.execute(update(Enrollment), [
+            {"student_id": student_id, "class_id": class_id, "grade": grade}
+            for student_id, grade in grades.items()
+        ])
+        db.session.commit()
+    return len(grades), errors
+
+@bp.route('/update-grades/<int:class_id>', methods=['POST'])
+@login_required(role='teacher')
+def update_grades(class_id):
+    require_teaching(class_id)
+    updated, errors = apply_grades(class_id, grade_rows_from_request())
+    report = {"updated": updated, "errors": errors}
+
+    if request.is_json or request.accept_mimetypes.best == 'application/json':
+        return jsonify(report), 400 if errors and not updated else 200
+    if not errors:
+        return redirect(url_for('main.teacher_view_course', class_id=class_id))
+    return render_roster(class_id, report=report)
+
+@bp.route('/update-grade/<int:student_id>/<int:class_id>', methods=['POST'])
+@login_required(role='teacher')
 def update_grade(student_id, class_id):
-    new_grade = request.form.get('grade')
+    require_teaching(class_id)
+    try:
+        new_grade = parse_grade(request.form.get('grade'))
+    except ValueError:
+        return redirect(request.referrer)
     
     # Find the enrollment and update the grade
     enrollment = Enrollment.query.filter_by(student_id=student_id, class_id=class_id).first()
@@ -363,38 +2587,304 @@ def update_grade(student_id, class_id):
     # Redirect back (or adjust based on where you're coming from)
     return redirect(request.referrer)
 
-@app.route('/teacher-dashboard', methods=['GET', 'POST'])
+# streaming exports for registrar staff, as CSV or JSON Lines with
+# optional gzip (?gzip=1)
+EXPORT_COLUMNS = ['class_id', 'class_name', 'student_id', 'uni_id', 'grade']
+EXPORT_YIELD_PER = 1000
+
+def requested_term():
+    # ?term=<id> picks a term, the active one by default
+    term_id = request.args.get('term', type=int)
+    return active_term() if term_id is None else term_id
+
+def export_query():
+    return select(Class.id, Class.name, User.id, User.uni_id, Enrollment.grade)\
+        .join(Enrollment, Enrollment.class_id == Class.id)\
+        .join(User, User.id == Enrollment.student_id)
+
+def stream_export(stmt, fmt, filename):
+    if session.get('role') != 'admin':
+        return redirect(url_for('main.admin_login'))
+    if fmt not in exports.FORMATS:
+        abort(404)
+    # fetched in batches from the cursor instead of as ORM objects
+    rows = db.session.execute(stmt.execution_options(yield_per=EXPORT_YIELD_PER))
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    return exports.stream_rows(EXPORT_COLUMNS, rows, fmt, filename, compress=compress)
+
+@bp.route('/export/classes/<int:class_id>/roster.<fmt>')
+def export_roster(class_id, fmt):
+    stmt = export_query()\
+        .where(Class.id == class_id, Class.term_id == requested_term())\
+        .order_by(User.uni_id)
+    return stream_export(stmt, fmt, f'roster-{class_id}')
+
+@bp.route('/export/teachers/<int:teacher_id>/gradebook.<fmt>')
+def export_gradebook(teacher_id, fmt):
+    stmt = export_query()\
+        .join(TeacherClass, TeacherClass.class_id == Class.id)\
+        .where(TeacherClass.teacher_id == teacher_id, Class.term_id == requested_term())\
+        .order_by(Class.id, User.uni_id)
+    return stream_export(stmt, fmt, f'gradebook-{teacher_id}')
+
+@bp.route('/export/enrollments.<fmt>')
+def export_enrollments(fmt):
+    stmt = export_query()\
+        .where(Class.term_id == requested_term())\
+        .order_by(Enrollment.class_id, Enrollment.student_id)
+    return stream_export(stmt, fmt, 'enrollments')
+
+@bp.route('/teacher-dashboard', methods=['GET', 'POST'])
+@login_required(role='teacher')
 def teacher_dashboard():
-    uni_id = session.get('uni_id')
-
-    if not uni_id:
-        return redirect(url_for('teacher_login'))
-
-    teacher = User.query.filter_by(uni_id=uni_id, role='teacher').first()
-    if not teacher:
-        return redirect(url_for('teacher_login')) 
+    teacher = g.identity
+    sections = db.session.query(TeacherClass.class_id, EntityVersion.version, EntityVersion.changed_at)\
+        .outerjoin(EntityVersion, and_(EntityVersion.entity == 'class',
+                                       EntityVersion.entity_id == TeacherClass.class_id))\
+        .filter(TeacherClass.teacher_id == teacher.id, in_term(TeacherClass.class_id))\
+        .order_by(TeacherClass.class_id)\
+        .all()
+    return conditional_page((teacher, [(class_id, version) for class_id, version, _ in sections]),
+                            [(version, changed_at) for _, version, changed_at in sections],
+                            lambda: render_dashboard(teacher))
+
+def render_dashboard(teacher):
+    # sections, seat counts and grade statistics in one query, histograms in a second
+    teaching = select(TeacherClass.class_id)\
+        .where(TeacherClass.teacher_id == teacher.id, in_term(TeacherClass.class_id))
+    seat_counts = db.session.query(Enrollment.class_id, func.count().label('student_count'))\
+        .filter(Enrollment.class_id.in_(teaching))\
+        .group_by(Enrollment.class_id)\
+        .subquery()
+    sections = db.session.query(TeacherClass, Class.name, ClassGradeStats,
+                                func.coalesce(seat_counts.c.student_count, 0))\
+        .join(Class, Class.id == TeacherClass.class_id)\
+        .outerjoin(ClassGradeStats, ClassGradeStats.class_id == TeacherClass.class_id)\
+        .outerjoin(seat_counts, seat_counts.c.class_id == TeacherClass.class_id)\
+        .filter(TeacherClass.teacher_id == teacher.id, Class.term_id == active_term())\
+        .order_by(Class.name)\
+        .all()
 
-    teacher_classes = TeacherClass.query.filter_by(teacher_id=teacher.id).all()
+    histograms = {}
+    for class_id, bucket, count in db.session.query(ClassGradeBucket.class_id, ClassGradeBucket.bucket,
+                                                    ClassGradeBucket.grade_count)\
+            .filter(ClassGradeBucket.class_id.in_(teaching), ClassGradeBucket.grade_count > 0):
+        histograms.setdefault(class_id, [0] * GRADE_BUCKETS)[bucket] = count
 
     courses = []
-    for entry in teacher_classes:
-        class_ = Class.query.get(entry.class_id)
-       
-
+    for entry, name, stats, student_count in sections:
+        has_grades = stats is not None and stats.grade_count > 0
         courses.append({
-            "id": class_.id,
-            "name": class_.name,
+            "id": entry.class_id,
+            "name": name,
             "teacher_name": teacher.uni_id,
             "time": entry.time,
             "day": entry.day,
-            "student_count": len(class_.students),
+            "student_count": student_count,
             "max_count": entry.max_seats,
+            "average": stats.mean if has_grades else None,
+            "stddev": stats.stddev if has_grades else None,
+            "min_grade": stats.min_grade if has_grades else None,
+            "max_grade": stats.max_grade if has_grades else None,
+            "histogram": histograms.get(entry.class_id, [0] * GRADE_BUCKETS),
         })
 
-    return render_template('teacher_dashboard.html', teacher_name=teacher.uni_id, teacher_courses=courses)
-
-
-@app.route('/student-test-data')
+    return render_template('Teacher_Dashboard.html', teacher_name=teacher.uni_id, teacher_courses=courses)
+
+
+# read-only JSON API, /api/v1. Every list is keyset paged (?after=
+# cursor, ?limit=) and takes ?fields= to pick columns; only the joins
+# the chosen fields need are added. Rows are serialized straight from
+# result tuples, never ORM instances. Sections, enrollments and rosters
+# are the active term's unless ?term= names another.
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+API_PAGE_SIZE = 50
+API_LIMIT_MAX = 500
+API_BATCH_MAX = 500
+
+# classes come from the catalog cache; description is read on demand
+CLASS_FIELDS = ('id', 'name', 'description', 'teacher_id', 'teacher_name', 'day', 'time',
+                'max_seats', 'student_count', 'is_full')
+
+# field -> (column, join it needs)
+SECTION_FIELDS = {
+    'class_id': (TeacherClass.class_id, None),
+    'teacher_id': (TeacherClass.teacher_id, None),
+    'day': (TeacherClass.day, None),
+    'time': (TeacherClass.time, None),
+    'max_seats': (TeacherClass.max_seats, None),
+    'days_mask': (TeacherClass.days_mask, None),
+    'start_minute': (TeacherClass.start_minute, None),
+    'end_minute': (TeacherClass.end_minute, None),
+    'class_name': (Class.name, 'class'),
+    'teacher_name': (User.uni_id, 'teacher'),
+}
+SECTION_JOINS = {
+    'class': (Class, Class.id == TeacherClass.class_id),
+    'teacher': (User, User.id == TeacherClass.teacher_id),
+}
+
+ENROLLMENT_FIELDS = {
+    'class_id': (Enrollment.class_id, None),
+    'grade': (Enrollment.grade, None),
+    'class_name': (Class.name, 'class'),
+}
+ENROLLMENT_JOINS = {'class': (Class, Class.id == Enrollment.class_id)}
+
+ROSTER_FIELDS = {
+    'student_id': (Enrollment.student_id, None),
+    'grade': (Enrollment.grade, None),
+    'uni_id': (User.uni_id, 'student'),
+}
+ROSTER_JOINS = {'student': (User, User.id == Enrollment.student_id)}
+
+@api.errorhandler(HTTPException)
+def api_error(error):
+    return jsonify({"error": error.description}), error.code
+
+@api.before_request
+def api_access():
+    # a signed-in student or teacher, or an admin session
+    g.is_admin = session.get('role') == 'admin'
+    g.identity = current_identity()
+    if g.identity is None and not g.is_admin:
+        abort(401, "sign in first")
+
+def requested_fields(allowed):
+    value = request.args.get('fields')
+    if not value:
+        return list(allowed)
+    fields = list(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        abort(400, f"unknown field(s) {', '.join(unknown)}; choose from {', '.join(allowed)}")
+    return fields
+
+def requested_limit():
+    limit = request.args.get('limit', API_PAGE_SIZE, type=int)
+    return min(max(limit, 1), API_LIMIT_MAX)
+
+def id_list(name):
+    try:
+        ids = list(dict.fromkeys(int(value) for value in request.args.get(name, '').split(',') if value))
+    except ValueError:
+        abort(400, f"{name} must be a comma separated list of ids")
+    if not ids or len(ids) > API_BATCH_MAX:
+        abort(400, f"{name} takes 1 to {API_BATCH_MAX} ids")
+    return ids
+
+def cursor(count):
+    # 'a' or 'a:b' -> tuple of ints, None on the first page
+    value = request.args.get('after')
+    if not value:
+        return None
+    try:
+        parts = tuple(int(part) for part in value.split(':'))
+    except ValueError:
+        parts = ()
+    if len(parts) != count:
+        abort(400, "bad cursor")
+    return parts
+
+def field_select(spec, joins, fields, base, keys=()):
+    # key columns first, so cursors can be read off the last row
+    stmt = select(*keys, *(spec[field][0] for field in fields)).select_from(base)
+    for name in dict.fromkeys(spec[field][1] for field in fields if spec[field][1]):
+        target, on = joins[name]
+        stmt = stmt.join(target, on)
+    return stmt
+
+def keyset_page(stmt, keys, fields, limit):
+    after = cursor(len(keys))
+    if after is not None:
+        stmt = stmt.where(tuple_(*keys) > tuple_(*after) if len(keys) > 1 else keys[0] > after[0])
+    rows = db.session.execute(stmt.order_by(*keys).limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = ':'.join(str(value) for value in rows[-1][:len(keys)])
+    width = len(keys)
+    return jsonify({"data": [dict(zip(fields, row[width:])) for row in rows], "next": next_cursor})
+
+def class_data(rows, fields):
+    descriptions = {}
+    if 'description' in fields and rows:
+        descriptions = dict(db.session.execute(
+            select(Class.id, Class.description).where(Class.id.in_([row["id"] for row in rows]))).all())
+    data = []
+    for row in rows:
+        item = {field: row[field] for field in fields if field != 'description'}
+        if 'description' in fields:
+            item['description'] = descriptions.get(row["id"])
+        data.append(item)
+    return data
+
+@api.route('/classes')
+def api_classes():
+    fields = requested_fields(CLASS_FIELDS)
+    after = cursor(1)
+    rows, next_cursor = catalog_page(catalog.rows(), after and after[0], requested_limit())
+    return jsonify({"data": class_data(rows, fields), "next": next_cursor})
+
+@api.route('/classes/batch')
+def api_classes_batch():
+    fields = requested_fields(CLASS_FIELDS)
+    ids = id_list('ids')
+    rows = catalog.get_many(ids)
+    return jsonify({"data": class_data([row for row in rows if row], fields),
+                    "missing": [class_id for class_id, row in zip(ids, rows) if not row]})
+
+@api.route('/classes/<int:class_id>')
+def api_class(class_id):
+    row = catalog.get(class_id)
+    if row is None:
+        abort(404, "no such class")
+    return jsonify(class_data([row], requested_fields(CLASS_FIELDS))[0])
+
+@api.route('/sections')
+def api_sections():
+    fields = requested_fields(SECTION_FIELDS)
+    keys = (TeacherClass.class_id, TeacherClass.teacher_id)
+    stmt = field_select(SECTION_FIELDS, SECTION_JOINS, fields, TeacherClass, keys)\
+        .where(in_term(TeacherClass.class_id, requested_term()))
+    for name in ('class_id', 'teacher_id'):
+        value = request.args.get(name, type=int)
+        if value is not None:
+            stmt = stmt.where(getattr(TeacherClass, name) == value)
+    return keyset_page(stmt, keys, fields, requested_limit())
+
+@api.route('/sections/batch')
+def api_sections_batch():
+    # every section of the given classes, one IN query
+    fields = requested_fields(SECTION_FIELDS)
+    stmt = field_select(SECTION_FIELDS, SECTION_JOINS, fields, TeacherClass)\
+        .where(TeacherClass.class_id.in_(id_list('class_ids')), in_term(TeacherClass.class_id, requested_term()))\
+        .order_by(TeacherClass.class_id, TeacherClass.teacher_id)
+    return jsonify({"data": [dict(zip(fields, row)) for row in db.session.execute(stmt)]})
+
+@api.route('/students/<int:student_id>/enrollments')
+def api_student_enrollments(student_id):
+    if not g.is_admin and g.identity.id != student_id:
+        abort(403, "only your own enrollments")
+    fields = requested_fields(ENROLLMENT_FIELDS)
+    keys = (Enrollment.class_id,)
+    stmt = field_select(ENROLLMENT_FIELDS, ENROLLMENT_JOINS, fields, Enrollment, keys)\
+        .where(Enrollment.student_id == student_id, in_term(Enrollment.class_id, requested_term()))
+    return keyset_page(stmt, keys, fields, requested_limit())
+
+@api.route('/classes/<int:class_id>/roster')
+def api_class_roster(class_id):
+    if not g.is_admin:
+        require_teaching(class_id, requested_term())
+    fields = requested_fields(ROSTER_FIELDS)
+    keys = (Enrollment.student_id,)
+    stmt = field_select(ROSTER_FIELDS, ROSTER_JOINS, fields, Enrollment, keys)\
+        .where(Enrollment.class_id == class_id, in_term(class_id, requested_term()))
+    return keyset_page(stmt, keys, fields, requested_limit())
+
+
+@bp.route('/student-test-data')
 def student_test_data():
     db.drop_all()
     db.create_all()
@@ -406,11 +2896,12 @@ def student_test_data():
 
     db.session.add_all([student, math, cs, physics])
     db.session.commit()
+    catalog.invalidate()
 
     return "Test student and course data created."
 
 
-@app.route('/sample-data')
+@bp.route('/sample-data')
 def init_sample_data():
     db.drop_all()
     db.create_all()
@@ -451,13 +2942,41 @@ def init_sample_data():
     ]
     db.session.add_all(enrollments)
     db.session.commit()
+    catalog.invalidate()
 
     return "✅ Sample data initialized!"
 
 
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.update(load_config())
+    if config:
+        app.config.update(config)
+    if not app.config['SECRET_KEY']:
+        secret_file = app.config['SECRET_KEY_FILE'] or os.path.join(app.instance_path, 'secret_key')
+        app.config['SECRET_KEY'] = shared_secret(secret_file)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    app.config.setdefault('SQLALCHEMY_BINDS', {
+        'archive': app.config['ARCHIVE_DATABASE_URL'] or archive_database_uri(app.config['SQLALCHEMY_DATABASE_URI']),
+    })
+    app.config.setdefault('PAGE_VERSION', page_version(app))
+
+    db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'connect', sqlite_pragmas(app.config))
+
+    # query counts, Server-Timing headers and /metrics
+    instrumentation.init_app(app)
+    admin.init_app(app)
+    app.register_blueprint(bp)
+    app.register_blueprint(api)
+    return app
 
 
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
         db.create_all()
-    app.run(debug=True)
\ No newline at end of file
+        upgrade_database()
+    app.run(debug=True)
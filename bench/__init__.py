@@ -0,0 +1 @@
+# load and stress tools for the enrollment app, run with python -m bench.<tool>
@@ -0,0 +1,188 @@
+# seeded synthetic dataset generator
+#
+# builds users, classes, sections and enrollments at any size and bulk
+# loads them with Core executemany batches, one transaction per table.
+# The tables' triggers are dropped for the load and put back after it,
+# and what they maintain is rebuilt in one pass
+#
+#   python -m bench.dataset --users 100000 --classes 5000 --enrollments 1000000
+
+import argparse
+import os
+import random
+import time
+
+import schedule
+
+BATCH_SIZE = 10000
+
+DAYS = ('MW', 'TT', 'MWF', 'F')
+TIMES = ('8:00-9:15 AM', '9:30-10:45 AM', '10:00-11:15 AM', '12:00-1:15 PM',
+         '1:00-2:15 PM', '3:00-4:15 PM', '4:30-5:45 PM')
+SUBJECTS = ('Math', 'History', 'CS', 'Physics', 'Chemistry', 'Biology', 'English',
+            'Economics', 'Psychology', 'Philosophy', 'Art', 'Music')
+
+
+class Dataset:
+    def __init__(self, users, classes, enrollments, seed=0):
+        self.users = users
+        self.classes = classes
+        self.enrollments = enrollments
+        self.seed = seed
+        # one teacher per three sections, everyone else is a student
+        self.teachers = max(1, classes // 3)
+        self.students = max(1, users - self.teachers)
+
+    def params(self):
+        return {
+            'users': self.users,
+            'classes': self.classes,
+            'enrollments': self.enrollments,
+            'seed': self.seed,
+        }
+
+    # ids are assigned here so the benchmark can address rows directly
+    def student_ids(self):
+        return range(1, self.students + 1)
+
+    def teacher_ids(self):
+        return range(self.students + 1, self.students + self.teachers + 1)
+
+    def class_ids(self):
+        return range(1, self.classes + 1)
+
+    def teacher_class_ids(self, teacher_id):
+        # sections go round-robin over the teachers, see teacher_class_rows
+        teacher_ids = self.teacher_ids()
+        return range(teacher_id - teacher_ids[0] + 1, self.classes + 1, len(teacher_ids))
+
+    def student_uni_id(self, student_id):
+        return f'student{student_id}'
+
+    def teacher_uni_id(self, teacher_id):
+        return f'teacher{teacher_id}'
+
+    def user_rows(self):
+        for student_id in self.student_ids():
+            yield {'id': student_id, 'uni_id': self.student_uni_id(student_id),
+                   'password': 'pass', 'role': 'student'}
+        for teacher_id in self.teacher_ids():
+            yield {'id': teacher_id, 'uni_id': self.teacher_uni_id(teacher_id),
+                   'password': 'pass', 'role': 'teacher'}
+
+    def class_rows(self):
+        rng = random.Random(self.seed)
+        for class_id in self.class_ids():
+            subject = rng.choice(SUBJECTS)
+            yield {'id': class_id, 'name': f'{subject} {class_id}',
+                   'description': f'Section {class_id} of {subject}'}
+
+    def enrollment_rows(self, seat_counts):
+        # spread enrollments evenly over students, each in distinct classes
+        rng = random.Random(self.seed + 1)
+        per_student, extra = divmod(self.enrollments, self.students)
+        class_ids = self.class_ids()
+        for student_id in self.student_ids():
+            count = min(per_student + (1 if student_id <= extra else 0), self.classes)
+            for class_id in rng.sample(class_ids, count):
+                seat_counts[class_id] = seat_counts.get(class_id, 0) + 1
+                yield {'student_id': student_id, 'class_id': class_id,
+                       'grade': round(rng.uniform(50, 100), 1)}
+
+    def teacher_class_rows(self, seat_counts):
+        rng = random.Random(self.seed + 2)
+        teacher_ids = self.teacher_ids()
+        for class_id in self.class_ids():
+            day = rng.choice(DAYS)
+            time_text = f'{day} {rng.choice(TIMES)}'
+            # leave some sections full and some with room
+            taken = seat_counts.get(class_id, 0)
+            # Core inserts skip the ORM hook that parses meeting times
+            days_mask, start_minute, end_minute = schedule.parse_meeting(day, time_text)
+            yield {'teacher_id': teacher_ids[(class_id - 1) % len(teacher_ids)],
+                   'class_id': class_id, 'day': day, 'time': time_text,
+                   'max_seats': max(taken + rng.randint(-5, 20), taken, 1),
+                   'days_mask': days_mask, 'start_minute': start_minute,
+                   'end_minute': end_minute}
+
+
+def batched(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def drop_triggers(conn, tables):
+    # returns the CREATE statements to put them back with
+    rows = conn.exec_driver_sql(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name IN (%s)"
+        % ', '.join('?' * len(tables)), tuple(tables)).all()
+    for name, _ in rows:
+        conn.exec_driver_sql(f'DROP TRIGGER {name}')
+    return [sql for _, sql in rows]
+
+
+def load(db, dataset):
+    # returns seconds spent per table
+    from app import DEFAULT_TERM_ID, User, Class, Enrollment, TeacherClass, catalog, recompute_grade_stats
+
+    db.drop_all()
+    db.create_all()
+    seat_counts = {}
+    timings = {}
+    # the term is set here rather than looked up per row by the default
+    class_rows = ({**row, 'term_id': DEFAULT_TERM_ID} for row in dataset.class_rows())
+    tables = (
+        (User.__table__, dataset.user_rows()),
+        (Class.__table__, class_rows),
+        (Enrollment.__table__, dataset.enrollment_rows(seat_counts)),
+        # after enrollments so max_seats can be set around the real counts
+        (TeacherClass.__table__, None),
+    )
+    with db.engine.begin() as conn:
+        triggers = drop_triggers(conn, [table.name for table, _ in tables])
+    for table, rows in tables:
+        if rows is None:
+            rows = dataset.teacher_class_rows(seat_counts)
+        start = time.perf_counter()
+        with db.engine.begin() as conn:
+            for batch in batched(rows):
+                conn.execute(table.insert(), batch)
+        timings[table.name] = time.perf_counter() - start
+
+    # a fresh database needs no change log or page versions, only the
+    # search index and grade statistics the triggers would have kept
+    start = time.perf_counter()
+    with db.engine.begin() as conn:
+        for sql in triggers:
+            conn.exec_driver_sql(sql)
+        conn.exec_driver_sql("INSERT INTO class_search(class_search) VALUES ('rebuild')")
+    recompute_grade_stats()
+    timings['rebuild'] = time.perf_counter() - start
+    catalog.invalidate()
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate and load a synthetic dataset')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--classes', type=int, default=5000)
+    parser.add_argument('--enrollments', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database', default='bench.db',
+                        help='SQLite file to (re)create')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(args.database)
+    from app import create_app, db
+    app = create_app()
+
+    with app.app_context():
+        timings = load(db, Dataset(args.users, args.classes, args.enrollments, args.seed))
+    for table, seconds in timings.items():
+        print(f'{table:<15} {seconds:8.2f}s')
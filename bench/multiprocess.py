@@ -0,0 +1,190 @@
+# multi-process serving check
+#
+# starts several worker processes, each building its own app from the
+# same environment the way wsgi.py does under a prefork server, all
+# against one SQLite file. Students register on one worker, log in on
+# another and enroll through all of them at once; every worker must
+# accept the session cookie, no section may go over max_seats and every
+# worker's catalog must show the same seat counts.
+#
+#   python -m bench.multiprocess --workers 4 --students 200
+
+import argparse
+import http.cookiejar
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+CLASS_PREFIX = 'Multiprocess'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def serve(port):
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    make_server('127.0.0.1', port, create_app(), threaded=True).serve_forever()
+
+
+def setup(classes, seats):
+    from app import create_app, db, upgrade_database, User, Class, TeacherClass
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        upgrade_database()
+        teacher = User(uni_id='multiprocess-teacher', password='x', role='teacher')
+        db.session.add(teacher)
+        db.session.add_all(Class(name=f'{CLASS_PREFIX} {i}') for i in range(classes))
+        db.session.commit()
+        db.session.add_all(TeacherClass(teacher_id=teacher.id, class_id=class_id, day='TBA',
+                                        time='TBA', max_seats=seats)
+                           for class_id in range(1, classes + 1))
+        db.session.commit()
+
+
+def wait_until_up(base):
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            urllib.request.urlopen(base + '/', timeout=1).close()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def student_session(bases, index, password='pass'):
+    # register on one worker, log in on the next; the cookie jar is then
+    # used against every worker
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar), NoRedirect)
+    uni_id = f'multiprocess-student-{index}'
+    form = urllib.parse.urlencode({'uni_id': uni_id, 'password': password}).encode()
+    request(opener, bases[index % len(bases)] + '/student-registration', form)
+    form = urllib.parse.urlencode({'username': uni_id, 'password': password}).encode()
+    request(opener, bases[(index + 1) % len(bases)] + '/student-login', form)
+    return opener
+
+
+def request(opener, url, data=None):
+    # (status, body); redirects are returned rather than followed
+    try:
+        with opener.open(url, data, timeout=30) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as error:
+        return error.code, error.read()
+
+
+def seat_counts(base):
+    opener = urllib.request.build_opener()
+    status, body = request(opener, f'{base}/courses/search?q={CLASS_PREFIX}&limit=200')
+    if status != 200:
+        raise RuntimeError(f'{base}: catalog search returned {status}')
+    return {row['id']: row['student_count'] for row in json.loads(body)['results']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check sessions and writes across worker processes')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--classes', type=int, default=5)
+    parser.add_argument('--seats', type=int, default=30)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    # no SECRET_KEY: the workers have to agree on the generated one
+    workdir = tempfile.mkdtemp(prefix='multiprocess_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'school.db')
+    os.environ['SECRET_KEY_FILE'] = os.path.join(workdir, 'secret_key')
+    os.environ.pop('SECRET_KEY', None)
+    setup(args.classes, args.seats)
+
+    context = multiprocessing.get_context('spawn')
+    ports = [free_port() for _ in range(args.workers)]
+    processes = [context.Process(target=serve, args=(port,), daemon=True) for port in ports]
+    for process in processes:
+        process.start()
+    bases = [f'http://127.0.0.1:{port}' for port in ports]
+    failures = []
+    try:
+        for base in bases:
+            wait_until_up(base)
+
+        pending = list(range(args.students))
+        pending_lock = threading.Lock()
+        results = []
+
+        def worker():
+            while True:
+                with pending_lock:
+                    if not pending:
+                        return
+                    index = pending.pop()
+                opener = student_session(bases, index)
+                # a session from another worker must be accepted everywhere
+                for base in bases:
+                    status, _ = request(opener, base + '/student-view-courses')
+                    if status != 200:
+                        failures.append(f'student {index}: {base} rejected the session ({status})')
+                class_id = index % args.classes + 1
+                status, _ = request(opener, f'{bases[index % len(bases)]}/enroll/{class_id}')
+                results.append(status)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        expected = {class_id: min(args.seats, len(range(class_id - 1, args.students, args.classes)))
+                    for class_id in range(1, args.classes + 1)}
+        with sqlite3.connect(os.path.join(workdir, 'school.db')) as conn:
+            stored = dict(conn.execute('SELECT class_id, count(*) FROM enrollment GROUP BY class_id'))
+        if stored != expected:
+            failures.append(f'database holds {stored}, expected {expected}')
+        for base in bases:
+            counts = seat_counts(base)
+            if counts != expected:
+                failures.append(f'{base}: catalog shows {counts}, expected {expected}')
+        errors = [status for status in results if status >= 400]
+        if errors:
+            failures.append(f'{len(errors)} enroll requests failed: {sorted(set(errors))}')
+        print(f'{args.students} students over {args.workers} workers in {elapsed:.2f}s, '
+              f'{sum(expected.values())} enrolled')
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+    for failure in failures[:20]:
+        print('FAIL', failure)
+    if failures:
+        sys.exit(1)
+    print('sessions, writes and catalog agree across workers')
+
+
+if __name__ == '__main__':
+    main()
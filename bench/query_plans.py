@@ -0,0 +1,161 @@
+# query plan regression check
+#
+# drives the hot routes through the Flask test client on a synthetic
+# dataset, records every statement each one sends, and runs EXPLAIN
+# QUERY PLAN on it with the same parameters. A route fails when one of
+# its statements scans a whole table (SCAN <table>, with or without a
+# covering index) unless the scan is listed in ALLOWED_SCANS.
+#
+#   python -m bench.query_plans
+#   python -m bench.query_plans --only teacher_view_course --verbose
+#
+# Statements run inside triggers aren't shown by EXPLAIN QUERY PLAN and
+# aren't checked.
+
+import argparse
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+
+from bench.dataset import Dataset, load
+from bench.routes import routes
+
+# "SCAN enrollment", "SCAN u USING COVERING INDEX ...", but not
+# subqueries, CTEs or virtual tables, which are matched by name below
+SCAN = re.compile(r'^SCAN (\S+)(?: AS \S+)?(?: USING (?:COVERING )?INDEX \S+)?$')
+
+DML = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+# (route or '*', table) -> why a full scan there is fine
+ALLOWED_SCANS = {
+    ('show_users', 'user'): 'the page lists every user',
+    ('*', 'term'): 'one row per term, a handful in total',
+}
+
+
+def hot_routes(dataset, rng):
+    # the benchmark routes plus the read paths it doesn't drive
+    student = lambda: rng.choice(dataset.student_ids())
+    class_id = lambda: rng.choice(dataset.class_ids())
+
+    def own_roster(client, teacher_id):
+        course_id = rng.choice(dataset.teacher_class_ids(teacher_id))
+        return client.get(f'/api/v1/classes/{course_id}/roster')
+
+    def cycle_waitlist(client, student_id):
+        course_id = class_id()
+        client.get(f'/waitlist/{course_id}')
+        return client.get(f'/leave-waitlist/{course_id}')
+
+    teacher = lambda: rng.choice(dataset.teacher_ids())
+    return routes(dataset, rng) + [
+        ('course_search', None, lambda c, u: c.get('/courses/search?q=Math')),
+        ('course_autocomplete', None, lambda c, u: c.get('/courses/autocomplete?q=Ma')),
+        ('sections_fitting', student, lambda c, u: c.get('/sections/fits-my-schedule')),
+        ('waitlist', student, cycle_waitlist),
+        ('api_classes', student, lambda c, u: c.get('/api/v1/classes?fields=id,name,description')),
+        ('api_sections', student, lambda c, u: c.get(f'/api/v1/sections?class_id={class_id()}')),
+        ('api_enrollments', student, lambda c, u: c.get(f'/api/v1/students/{u}/enrollments')),
+        ('api_roster', teacher, own_roster),
+    ]
+
+
+def full_scans(conn, statement, parameters, tables):
+    # tables the statement reads end to end
+    plan = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+    scanned = []
+    for _, _, _, detail in plan:
+        match = SCAN.match(detail)
+        if match and match.group(1) in tables:
+            scanned.append((match.group(1), detail))
+    return scanned, [detail for _, _, _, detail in plan]
+
+
+def check_route(app, db, dataset, name, role, make_request, iterations):
+    # {(table, statement): plan} for the scans this route isn't allowed
+    from sqlalchemy import event
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(DML):
+            statements.append((statement, parameters))
+
+    client = app.test_client()
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            for _ in range(iterations):
+                user_id = None
+                if role is not None:
+                    user_id = role()
+                    user_role = 'student' if user_id in dataset.student_ids() else 'teacher'
+                    with client.session_transaction() as sess:
+                        sess['identity'] = {'id': user_id, 'role': user_role, 'version': 0}
+                make_request(client, user_id)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        tables = set(db.metadata.tables)
+        failures = {}
+        with db.engine.connect() as conn:
+            for statement, parameters in statements:
+                scanned, plan = full_scans(conn, statement, parameters, tables)
+                for table, _ in scanned:
+                    if (name, table) in ALLOWED_SCANS or ('*', table) in ALLOWED_SCANS:
+                        continue
+                    failures[(table, statement)] = plan
+    return len(statements), failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fail on full table scans in hot route queries')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--classes', type=int, default=200)
+    parser.add_argument('--enrollments', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=3, help='requests per route')
+    parser.add_argument('--only', action='append', help='check only these routes')
+    parser.add_argument('--verbose', action='store_true', help='print the plan of every failing statement')
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(prefix='query_plans_'), 'plans.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + database
+    from app import catalog, create_app, db
+    app = create_app()
+    app.logger.setLevel(logging.ERROR)
+
+    dataset = Dataset(args.users, args.classes, args.enrollments, args.seed)
+    rng = random.Random(args.seed)
+    with app.app_context():
+        load(db, dataset)
+        # plans as a long-running database would have them
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+        # the whole catalog is read once per process, not per request
+        catalog.rows()
+
+    failed = 0
+    for name, role, make_request in hot_routes(dataset, rng):
+        if args.only and name not in args.only:
+            continue
+        count, failures = check_route(app, db, dataset, name, role, make_request, args.requests)
+        tables = sorted({table for table, _ in failures})
+        print(f'{name:<22} {count:4d} statements  ' + (f'SCAN {", ".join(tables)}' if tables else 'ok'))
+        for (table, statement), plan in failures.items():
+            failed += 1
+            print(f'    {table}: {" ".join(statement.split())[:160]}')
+            if args.verbose:
+                for line in plan:
+                    print(f'        {line}')
+    if failed:
+        print(f'{failed} statement(s) scan a whole table')
+        sys.exit(1)
+    print('no unexpected full table scans')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# throughput of queued registration against the synchronous enroll path
+#
+# the same burst of enroll clicks is fired through the Flask test client
+# from many threads, once with REGISTRATION_MODE=sync and once queued,
+# timing until every enrollment has been decided
+#
+#   python -m bench.registration_queue --requests 2000 --threads 32 --workers 2
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+def setup(app, db, students, classes, seats):
+    from app import User, Class, TeacherClass, catalog
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        teacher = User(uni_id='queue-teacher', password='x', role='teacher')
+        db.session.add(teacher)
+        db.session.add_all(Class(name=f'Queue {i}') for i in range(classes))
+        db.session.add_all(User(uni_id=f'queue-student-{i}', password='x', role='student')
+                           for i in range(students))
+        db.session.commit()
+        # no meeting times, so schedule conflicts never reject a click
+        db.session.add_all(TeacherClass(teacher_id=teacher.id, class_id=class_id, day='TBA',
+                                        time='TBA', max_seats=seats)
+                           for class_id in range(1, classes + 1))
+        db.session.commit()
+        student_ids = dict(db.session.query(User.uni_id, User.id).filter_by(role='student'))
+    catalog.invalidate()
+    return student_ids
+
+
+def fire(app, clicks, threads):
+    # clicks: list of (student id, class_id); returns tickets when queued
+    pending = list(clicks)
+    pending_lock = threading.Lock()
+    start = threading.Barrier(threads)
+    tickets = []
+    errors = []
+
+    def worker():
+        client = app.test_client()
+        start.wait()
+        while True:
+            with pending_lock:
+                if not pending:
+                    return
+                student_id, class_id = pending.pop()
+            with client.session_transaction() as sess:
+                sess['identity'] = {'id': student_id, 'role': 'student', 'version': 0}
+            response = client.get(f'/enroll/{class_id}', headers={'Accept': 'application/json'})
+            if response.status_code == 202:
+                tickets.append(response.get_json()['ticket'])
+            elif response.status_code != 302:
+                errors.append(response.status_code)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return tickets, errors
+
+
+def run_mode(app, db, mode, args):
+    from app import Enrollment, RegistrationRequest, registration_workers
+
+    student_ids = setup(app, db, args.requests, args.classes, args.seats)
+    app.config['REGISTRATION_MODE'] = mode
+    app.config['REGISTRATION_WORKERS'] = args.workers
+    app.config['REGISTRATION_BATCH_SIZE'] = args.batch_size
+    clicks = [(student_ids[f'queue-student-{i}'], i % args.classes + 1) for i in range(args.requests)]
+
+    started = time.perf_counter()
+    tickets, errors = fire(app, clicks, args.threads)
+    accepted = time.perf_counter() - started
+    if mode == 'queued':
+        with app.app_context():
+            while RegistrationRequest.query.filter_by(status='pending').count():
+                time.sleep(0.01)
+        registration_workers.stop()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        enrolled = Enrollment.query.count()
+    return {
+        'requests': args.requests,
+        'errors': len(errors),
+        'enrolled': enrolled,
+        'accepted_seconds': round(accepted, 3),
+        'total_seconds': round(elapsed, 3),
+        'requests_per_second': round(args.requests / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Queued vs synchronous registration throughput')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--classes', type=int, default=50)
+    parser.add_argument('--seats', type=int, default=30)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='registration_queue_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'queue.db')
+    from app import create_app, db
+    app = create_app()
+    app.logger.setLevel(logging.ERROR)
+
+    results = {}
+    for mode in ('sync', 'queued'):
+        results[mode] = stats = run_mode(app, db, mode, args)
+        print(f'{mode:<7} {stats["requests_per_second"]:8.1f} req/s  '
+              f'(accepted in {stats["accepted_seconds"]}s, decided in {stats["total_seconds"]}s, '
+              f'{stats["enrolled"]} enrolled, {stats["errors"]} errors)')
+    if results['sync']['enrolled'] != results['queued']['enrolled']:
+        print('WARNING: modes enrolled different numbers of students')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+# route benchmark
+#
+# loads a seeded synthetic dataset, drives every route through the
+# Flask test client and reports p50/p95/p99 latency, queries per request
+# and peak RSS. Results are written as JSON; pass --compare with an
+# earlier result to fail on regressions.
+#
+#   python -m bench.routes --users 100000 --classes 5000 --enrollments 1000000 \
+#       --output bench_results.json --compare previous.json
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.dataset import Dataset, load
+
+QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, round(pct / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def peak_rss_kb():
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def routes(dataset, rng):
+    # (name, role, request builder) for every route except the fixtures
+    # that drop the database
+    student = lambda: rng.choice(dataset.student_ids())
+    teacher = lambda: rng.choice(dataset.teacher_ids())
+    class_id = lambda: rng.choice(dataset.class_ids())
+
+    # teachers only see and grade their own classes
+    own_class = lambda teacher_id: rng.choice(dataset.teacher_class_ids(teacher_id))
+
+    def cycle_enrollment(client, student_id):
+        course_id = class_id()
+        client.get(f'/enroll/{course_id}')
+        return client.get(f'/unenroll/{course_id}')
+
+    return [
+        ('home', None, lambda c, u: c.get('/')),
+        ('admin_login', None, lambda c, u: c.get('/admin_login')),
+        ('student_registration', None, lambda c, u: c.get('/student-registration')),
+        ('student_login', None, lambda c, u: c.get('/student-login')),
+        ('teacher_registration', None, lambda c, u: c.get('/teacher-registration')),
+        ('teacher_login', None, lambda c, u: c.get('/teacher-login')),
+        ('forgot_password', None, lambda c, u: c.post('/forgot-password/student',
+                                                      data={'uni_id': dataset.student_uni_id(student())})),
+        ('student_view_courses', student, lambda c, u: c.get('/student-view-courses')),
+        ('student_add_courses', student, lambda c, u: c.get('/student-add-courses')),
+        ('student_transcript', student, lambda c, u: c.get('/student-transcript')),
+        ('enroll_unenroll', student, cycle_enrollment),
+        ('teacher_dashboard', teacher, lambda c, u: c.get('/teacher-dashboard')),
+        ('teacher_view_course', teacher, lambda c, u: c.get(f'/teacher-view-course/{own_class(u)}')),
+        ('update_grade', teacher, lambda c, u: c.post(f'/update-grade/{student()}/{own_class(u)}',
+                                                      data={'grade': '90'},
+                                                      headers={'Referer': '/teacher-dashboard'})),
+        ('show_users', None, lambda c, u: c.get('/users')),
+        ('metrics', None, lambda c, u: c.get('/metrics')),
+    ]
+
+
+def run_route(app, dataset, role, make_request, iterations):
+    client = app.test_client()
+    latencies = []
+    queries = []
+    errors = 0
+    for _ in range(iterations):
+        user_id = None
+        if role is not None:
+            user_id = role()
+            user_role = 'student' if user_id in dataset.student_ids() else 'teacher'
+            with client.session_transaction() as sess:
+                sess['identity'] = {'id': user_id, 'role': user_role, 'version': 0}
+        start = time.perf_counter()
+        response = make_request(client, user_id)
+        latencies.append((time.perf_counter() - start) * 1000)
+        # bounced to a login page counts as a failure too
+        if response.status_code >= 400 or '-login' in (response.location or ''):
+            errors += 1
+        match = QUERIES.search(', '.join(response.headers.getlist('Server-Timing')))
+        if match:
+            queries.append(int(match.group(1)))
+    latencies.sort()
+    return {
+        'requests': iterations,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_queries': round(sum(queries) / len(queries), 2) if queries else None,
+        'max_queries': max(queries) if queries else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous, tolerance):
+    # a route regresses when p95 grows past the tolerance or it issues more queries
+    regressions = []
+    for name, now in results['routes'].items():
+        before = previous.get('routes', {}).get(name)
+        if not before:
+            continue
+        if before['p95_ms'] and now['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {before["p95_ms"]}ms -> {now["p95_ms"]}ms')
+        if before['mean_queries'] is not None and now['mean_queries'] is not None \
+                and now['mean_queries'] > before['mean_queries']:
+            regressions.append(f'{name}: queries/request {before["mean_queries"]} -> {now["mean_queries"]}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every route on a synthetic dataset')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--classes', type=int, default=500)
+    parser.add_argument('--enrollments', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=100, help='requests per route')
+    parser.add_argument('--only', action='append', help='benchmark only these routes')
+    parser.add_argument('--database', help='SQLite file to use (default: a temp file)')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='earlier results file to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed p95 growth when comparing (default 0.2)')
+    args = parser.parse_args()
+
+    database = args.database or os.path.join(tempfile.mkdtemp(prefix='bench_'), 'bench.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(database)
+    from app import create_app, db
+    app = create_app()
+    # suspected N+1 warnings would drown the report
+    app.logger.setLevel(logging.ERROR)
+
+    dataset = Dataset(args.users, args.classes, args.enrollments, args.seed)
+    rng = random.Random(args.seed)
+    with app.app_context():
+        load_timings = load(db, dataset)
+    rss_after_load = peak_rss_kb()
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'dataset': dataset.params(),
+        'load_seconds': {table: round(s, 3) for table, s in load_timings.items()},
+        'routes': {},
+    }
+    for name, role, make_request in routes(dataset, rng):
+        if args.only and name not in args.only:
+            continue
+        stats = run_route(app, dataset, role, make_request, args.requests)
+        results['routes'][name] = stats
+        print(f'{name:<22} p50 {stats["p50_ms"]:9.2f}ms  p95 {stats["p95_ms"]:9.2f}ms  '
+              f'p99 {stats["p99_ms"]:9.2f}ms  queries {stats["mean_queries"]}  '
+              f'errors {stats["errors"]}')
+    results['peak_rss_kb'] = {'after_load': rss_after_load, 'total': peak_rss_kb()}
+    print(f'peak RSS {results["peak_rss_kb"]["total"] / 1024:.1f} MB')
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print('REGRESSION', line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# fire many concurrent enrollments at one section through the Flask
+# test client and check the section ends up exactly full
+#
+#   python -m bench.stress_enroll --students 200 --max-seats 25
+
+import argparse
+import os
+import tempfile
+import threading
+
+
+def run(students, max_seats, threads):
+    # point the app at a throwaway database before it is created
+    workdir = tempfile.mkdtemp(prefix='stress_enroll_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'stress.db')
+
+    from app import create_app, db, User, Class, Enrollment, TeacherClass
+    app = create_app()
+
+    with app.app_context():
+        db.create_all()
+        teacher = User(uni_id='stress-teacher', password='x', role='teacher')
+        course = Class(name='Stress 101')
+        db.session.add_all([teacher, course])
+        db.session.commit()
+        db.session.add(TeacherClass(teacher_id=teacher.id, class_id=course.id,
+                                    day='MW', time='MW 10:00-11:15 AM', max_seats=max_seats))
+        uni_ids = [f'stress-student-{i}' for i in range(students)]
+        db.session.add_all(User(uni_id=uni_id, password='x', role='student') for uni_id in uni_ids)
+        db.session.commit()
+        course_id = course.id
+        student_ids = [user_id for (user_id,) in db.session.query(User.id).filter_by(role='student')]
+
+    pending = list(student_ids)
+    pending_lock = threading.Lock()
+    start = threading.Barrier(threads)
+    errors = []
+
+    def worker():
+        client = app.test_client()
+        start.wait()
+        while True:
+            with pending_lock:
+                if not pending:
+                    return
+                student_id = pending.pop()
+            with client.session_transaction() as sess:
+                sess['identity'] = {'id': student_id, 'role': 'student', 'version': 0}
+            response = client.get(f'/enroll/{course_id}')
+            if response.status_code != 302 or '/student-add-courses' not in response.location:
+                errors.append((student_id, response.status_code))
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+    with app.app_context():
+        enrolled = Enrollment.query.filter_by(class_id=course_id).count()
+
+    print(f'{students} students, {threads} threads, max_seats={max_seats}: '
+          f'{enrolled} enrolled, {len(errors)} failed requests')
+    assert not errors, errors[:5]
+    assert enrolled == max_seats, f'expected {max_seats} enrollments, got {enrolled}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Concurrent enrollment stress test')
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--max-seats', type=int, default=25)
+    parser.add_argument('--threads', type=int, default=32)
+    args = parser.parse_args()
+    run(args.students, args.max_seats, args.threads)
@@ -0,0 +1,74 @@
+# streaming CSV / JSON Lines encoding for the export endpoints
+#
+# rows are encoded a chunk at a time as they come off the cursor, so
+# memory stays flat no matter how many rows there are, and the header
+# goes out before the first row is fetched
+
+import csv
+import io
+import json
+import zlib
+
+from flask import Response, stream_with_context
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+CHUNK_ROWS = 1000
+
+
+def encode_csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for chunk in chunked(rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+
+
+def encode_jsonl(columns, rows):
+    # nothing to send before the first row, but don't make the client wait for it
+    yield ''
+    for chunk in chunked(rows):
+        yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in chunk)
+
+
+def chunked(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_ROWS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def gzipped(pieces):
+    # sync flush after every chunk so the client can decode as it arrives
+    compressor = zlib.compressobj(wbits=31)
+    for piece in pieces:
+        data = compressor.compress(piece.encode('utf-8'))
+        yield data + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def stream_rows(columns, rows, fmt, filename, compress=False):
+    encode = encode_csv if fmt == 'csv' else encode_jsonl
+    pieces = encode(columns, rows)
+    if compress:
+        body = gzipped(pieces)
+    else:
+        body = (piece.encode('utf-8') for piece in pieces)
+
+    response = Response(stream_with_context(body), mimetype=FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
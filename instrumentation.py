@@ -0,0 +1,184 @@
+# per-request SQL instrumentation
+#
+# counts queries and database time for every request, flags statements
+# repeated within one request as suspected N+1 loops, reports timings in
+# a Server-Timing header and keeps per-endpoint histograms served in
+# Prometheus text format from /metrics
+#
+# config:
+#   SQL_N_PLUS_ONE_THRESHOLD  same statement this many times in one request
+#                             is reported as a suspected N+1 (default 3)
+#   SQL_QUERY_BUDGET          max queries per request (default None)
+#   SQL_STRICT                raise QueryBudgetExceeded instead of logging
+#                             when a request goes over the budget, for
+#                             tests (default False)
+
+import threading
+import time
+from collections import Counter
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+                break
+        self.total += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for upper, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{upper}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.total}'
+        yield f'{name}_sum{{{labels}}} {self.sum:.6f}'
+        yield f'{name}_count{{{labels}}} {self.total}'
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._db_time = {}
+        self._queries = {}
+        self._n_plus_one = Counter()
+
+    def observe(self, endpoint, seconds, db_seconds, query_count, suspects):
+        with self._lock:
+            if endpoint not in self._latency:
+                self._latency[endpoint] = Histogram(LATENCY_BUCKETS)
+                self._db_time[endpoint] = Histogram(LATENCY_BUCKETS)
+                self._queries[endpoint] = Histogram(QUERY_BUCKETS)
+            self._latency[endpoint].observe(seconds)
+            self._db_time[endpoint].observe(db_seconds)
+            self._queries[endpoint].observe(query_count)
+            if suspects:
+                self._n_plus_one[endpoint] += 1
+
+    def render(self):
+        families = (
+            ('http_request_duration_seconds', 'histogram',
+             'Request latency by endpoint', self._latency),
+            ('db_time_per_request_seconds', 'histogram',
+             'Database time per request by endpoint', self._db_time),
+            ('db_queries_per_request', 'histogram',
+             'SQL statements per request by endpoint', self._queries),
+        )
+        out = []
+        with self._lock:
+            for name, kind, help_text, histograms in families:
+                out.append(f'# HELP {name} {help_text}')
+                out.append(f'# TYPE {name} {kind}')
+                for endpoint in sorted(histograms):
+                    out.extend(histograms[endpoint].lines(name, f'endpoint="{endpoint}"'))
+            out.append('# HELP db_n_plus_one_requests_total Requests with a suspected N+1 query pattern')
+            out.append('# TYPE db_n_plus_one_requests_total counter')
+            for endpoint in sorted(self._n_plus_one):
+                out.append(f'db_n_plus_one_requests_total{{endpoint="{endpoint}"}} {self._n_plus_one[endpoint]}')
+        return '\n'.join(out) + '\n'
+
+
+metrics = EndpointMetrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_stats' in g:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_query(conn, cursor, statement, parameters, context, executemany):
+    if not (has_request_context() and 'sql_stats' in g):
+        return
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    stats = g.sql_stats
+    stats['time'] += time.perf_counter() - starts.pop()
+    stats['count'] += 1
+    stats['statements'][statement] += 1
+
+
+@event.listens_for(Engine, 'handle_error')
+def _failed_query(context):
+    # a failed statement never reaches after_cursor_execute, so its start
+    # would stay on the pooled connection
+    conn = context.connection
+    if conn is not None and context.execution_context is not None:
+        starts = conn.info.get('query_start')
+        if starts:
+            starts.pop()
+
+
+def _before_request():
+    g.sql_stats = {'count': 0, 'time': 0.0, 'statements': Counter()}
+    g.request_start = time.perf_counter()
+
+
+def suspected_n_plus_one(statements, threshold):
+    # lazy loads show up as the same SELECT with different parameters
+    return [(statement, count) for statement, count in statements.most_common()
+            if count >= threshold and statement.lstrip().upper().startswith('SELECT')]
+
+
+def _after_request_for(app):
+    def after_request(response):
+        stats = g.pop('sql_stats', None)
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - g.pop('request_start')
+        endpoint = request.endpoint or 'unmatched'
+        suspects = suspected_n_plus_one(stats['statements'],
+                                        app.config['SQL_N_PLUS_ONE_THRESHOLD'])
+
+        response.headers.add('Server-Timing',
+                             f'db;dur={stats["time"] * 1000:.2f};desc="{stats["count"]} queries"')
+        response.headers.add('Server-Timing', f'app;dur={elapsed * 1000:.2f}')
+        if endpoint != 'metrics':
+            metrics.observe(endpoint, elapsed, stats['time'], stats['count'], suspects)
+
+        where = f'{request.method} {request.path} ({endpoint})'
+        for statement, count in suspects:
+            app.logger.warning('%s: suspected N+1, ran %d times: %s',
+                               where, count, ' '.join(statement.split()))
+        budget = app.config['SQL_QUERY_BUDGET']
+        if budget is not None and stats['count'] > budget:
+            message = f'{where}: {stats["count"]} queries, budget is {budget}'
+            if app.config['SQL_STRICT']:
+                raise QueryBudgetExceeded(message)
+            app.logger.warning(message)
+        return response
+    return after_request
+
+
+def metrics_view():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    app.config.setdefault('SQL_N_PLUS_ONE_THRESHOLD', 3)
+    app.config.setdefault('SQL_QUERY_BUDGET', None)
+    app.config.setdefault('SQL_STRICT', False)
+    app.before_request(_before_request)
+    app.after_request(_after_request_for(app))
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,145 @@
+# meeting times
+#
+# TeacherClass.day / TeacherClass.time are free text like 'MW' and
+# 'MW 10:00-11:15 AM'. They are parsed into a weekday bitmask plus start
+# and end minutes after midnight, and a student's meetings are kept in a
+# per-weekday interval index that answers overlap checks with a bisect.
+
+import re
+from bisect import bisect_left
+from itertools import accumulate
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MON, TUE, WED, THU, FRI, SAT, SUN = (1 << i for i in range(7))
+
+DAY_TOKEN = re.compile(r'Th|Tu|Sa|Su|M|T|W|R|F|S|U')
+# a whole day string: day tokens, optionally split by spaces, commas or slashes
+DAY_LIST = r'(?:Th|Tu|Sa|Su|M|T|W|R|F|S|U)(?:[\s,/]*(?:Th|Tu|Sa|Su|M|T|W|R|F|S|U))*'
+DAYS = re.compile(r'\s*' + DAY_LIST + r'\s*')
+DAY_BITS = {'M': MON, 'Tu': TUE, 'W': WED, 'Th': THU, 'R': THU, 'F': FRI,
+            'Sa': SAT, 'S': SAT, 'Su': SUN, 'U': SUN}
+
+# the whole text: an optional day prefix, then the range
+TIME_RANGE = re.compile(
+    r'^\s*(?:' + DAY_LIST + r'\s+)?'
+    r'(?P<start>\d{1,2})(?::(?P<start_min>[0-5]\d))?\s*(?P<start_ampm>[AaPp][Mm])?'
+    r'\s*-\s*'
+    r'(?P<end>\d{1,2})(?::(?P<end_min>[0-5]\d))?\s*(?P<end_ampm>[AaPp][Mm])?\s*$'
+)
+
+CLOCK = re.compile(r'^\s*(\d{1,2})(?::([0-5]\d))?\s*([AaPp][Mm])?\s*$')
+
+
+def parse_days(text):
+    # 'MW' -> MON|WED; a 'T' after Tuesday or Wednesday is Thursday, so
+    # 'TT' is like 'TR' and 'MTWTF' is the whole week. 0 for anything
+    # that isn't only days, like 'TBA'
+    if not DAYS.fullmatch(text or ''):
+        return 0
+    mask = 0
+    previous = None
+    for token in DAY_TOKEN.findall(text):
+        if token == 'T':
+            bit = THU if previous in (TUE, WED) else TUE
+        else:
+            bit = DAY_BITS[token]
+        mask |= bit
+        previous = bit
+    return mask
+
+
+def to_minutes(hour, minute, ampm):
+    hour = int(hour)
+    minute = int(minute or 0)
+    if ampm:
+        hour = hour % 12 + (12 if ampm.lower() == 'pm' else 0)
+    return hour * 60 + minute
+
+
+def parse_clock(text):
+    # '13:30' or '1:30 PM' -> 810, None if it isn't a time of day
+    match = CLOCK.match(text or '')
+    if not match:
+        return None
+    minutes = to_minutes(*match.groups())
+    return minutes if 0 <= minutes <= 24 * 60 else None
+
+
+def parse_time_range(text):
+    # '10:00-11:15 AM' -> (600, 675), None when there is no range
+    match = TIME_RANGE.match(text or '')
+    if not match:
+        return None
+    start_ampm = match['start_ampm']
+    end_ampm = match['end_ampm']
+    end = to_minutes(match['end'], match['end_min'], end_ampm)
+    if start_ampm:
+        start = to_minutes(match['start'], match['start_min'], start_ampm)
+    else:
+        # '11:00-12:15 PM' starts in the morning, '1:00-2:15 PM' in the afternoon
+        start = to_minutes(match['start'], match['start_min'], end_ampm)
+        if end_ampm and start >= end:
+            start = to_minutes(match['start'], match['start_min'], 'am')
+    if not (0 <= start < end <= 24 * 60):
+        return None
+    return start, end
+
+
+def parse_meeting(day, time):
+    # (days_mask, start_minute, end_minute), or None if it can't be parsed
+    time_range = parse_time_range(time)
+    if time_range is None:
+        return None
+    # the day column wins, otherwise use the days in front of the time
+    days_mask = parse_days(day) or parse_days((time or '').split(maxsplit=1)[0])
+    if not days_mask:
+        return None
+    return (days_mask, *time_range)
+
+
+def format_minutes(minutes):
+    hour, minute = divmod(minutes, 60)
+    return f'{(hour - 1) % 12 + 1}:{minute:02d} {"PM" if hour >= 12 else "AM"}'
+
+
+def weekdays(mask):
+    return [i for i in range(7) if mask & (1 << i)]
+
+
+class Timetable:
+    # a student's meetings: per weekday, intervals sorted by start with a
+    # running max of end times so one bisect finds any overlap
+
+    def __init__(self, meetings=()):
+        by_day = [[] for _ in WEEKDAYS]
+        for days_mask, start, end, key in meetings:
+            for day in weekdays(days_mask):
+                by_day[day].append((start, end, key))
+        self._starts = []
+        self._intervals = []
+        self._max_end = []
+        for intervals in by_day:
+            intervals.sort()
+            self._intervals.append(intervals)
+            self._starts.append([start for start, _, _ in intervals])
+            self._max_end.append(list(accumulate((end for _, end, _ in intervals), max)))
+
+    def conflicts(self, days_mask, start, end):
+        # keys of meetings overlapping [start, end) on any of the days
+        found = []
+        for day in weekdays(days_mask):
+            # every interval before i starts before this one ends
+            i = bisect_left(self._starts[day], end)
+            if i == 0 or self._max_end[day][i - 1] <= start:
+                continue
+            for other_start, other_end, key in reversed(self._intervals[day][:i]):
+                if other_end > start and key not in found:
+                    found.append(key)
+        return found
+
+    def fits(self, days_mask, start, end):
+        for day in weekdays(days_mask):
+            i = bisect_left(self._starts[day], end)
+            if i and self._max_end[day][i - 1] > start:
+                return False
+        return True
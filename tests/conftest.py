@@ -0,0 +1,67 @@
+import pytest
+
+import app as school
+import instrumentation
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches(monkeypatch):
+    # the caches and metrics belong to the process, every test has its
+    # own database
+    monkeypatch.setattr(school, 'catalog', school.CatalogCache())
+    monkeypatch.setattr(instrumentation, 'metrics', instrumentation.EndpointMetrics())
+    for cache in (school.identities, school.fragments, school.admin_counts, school.admin_pages):
+        cache.invalidate()
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    # apps built like separate workers: one database file and one
+    # generated session key, whatever the environment says
+    def make_app(**config):
+        app = school.create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "school.db"}',
+            'ARCHIVE_DATABASE_URL': None,
+            'SECRET_KEY': None,
+            'SECRET_KEY_FILE': str(tmp_path / 'secret_key'),
+            'REGISTRATION_MODE': 'sync',
+            **config,
+        })
+        with app.app_context():
+            school.upgrade_database()
+        return app
+    return make_app
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+def add_class(name, max_seats=30, day='MW', time='MW 10:00-11:15 AM', teacher=None):
+    # a class with one section; returns its id
+    if teacher is None:
+        teacher = school.User(uni_id=f'{name} teacher', password='x', role='teacher')
+        school.db.session.add(teacher)
+    course = school.Class(name=name)
+    school.db.session.add(course)
+    school.db.session.flush()
+    school.db.session.add(school.TeacherClass(teacher_id=teacher.id, class_id=course.id,
+                                              day=day, time=time, max_seats=max_seats))
+    school.db.session.commit()
+    return course.id
+
+
+def add_students(count, prefix='student'):
+    # returns their ids
+    students = [school.User(uni_id=f'{prefix}-{i}', password='x', role='student')
+                for i in range(count)]
+    school.db.session.add_all(students)
+    school.db.session.commit()
+    return [student.id for student in students]
+
+
+def sign_in_as(client, user_id, role='student'):
+    with client.session_transaction() as sess:
+        sess['identity'] = {'id': user_id, 'role': role, 'version': 0}
@@ -0,0 +1,36 @@
+import app as school
+from conftest import add_class, add_students
+
+
+def test_bulk_enroll_refuses_a_class_outside_the_active_term(app):
+    with app.app_context():
+        closed_id = add_class('Last Term 101')
+        student_ids = add_students(3)
+        school.start_term('Next term')
+        current_id = add_class('This Term 101', max_seats=2)
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['role'] = 'admin'
+
+    def bulk(class_id, operation='enroll'):
+        response = client.post('/admin/enrollment/bulk/', data={
+            'class_id': class_id, 'students': 'student-0, student-1, student-2',
+            'operation': operation})
+        with client.session_transaction() as sess:
+            return response, [message for _, message in sess.pop('_flashes', [])]
+
+    # the form is shown again with the error
+    for operation in ('enroll', 'drop'):
+        response, _ = bulk(closed_id, operation)
+        assert response.status_code == 200
+        assert (f'Class {closed_id} is not offered in the active term.'
+                in response.get_data(as_text=True))
+
+    response, flashed = bulk(current_id)
+    assert response.status_code == 302
+    assert flashed == [f'2 enrolled in class {current_id}, 0 already enrolled, '
+                       '0 not students, 1 without a seat.']
+    with app.app_context():
+        assert school.Enrollment.query.count() == 2
+        assert {student_id for (student_id,) in school.db.session.query(
+            school.Enrollment.student_id)} == set(student_ids[:2])
@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import Counter
+
+import app as school
+from conftest import add_class, add_students, sign_in_as
+
+STUDENTS = 60
+MAX_SEATS = 7
+THREADS = 12
+# a refused enroll runs 7 statements; while other enrolls keep changing
+# the section, each catalog lookup may reload its row once more
+ENROLL_QUERY_BUDGET = 12
+
+
+def run_concurrently(items, handle):
+    # THREADS threads take items until none are left, starting together
+    pending = list(items)
+    lock = threading.Lock()
+    start = threading.Barrier(THREADS)
+    results, errors = [], []
+
+    def worker():
+        start.wait()
+        while True:
+            with lock:
+                if not pending:
+                    return
+                item = pending.pop()
+            try:
+                results.append(handle(item))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, errors[:3]
+    return results
+
+
+def enrolled_in(class_id):
+    return school.Enrollment.query.filter_by(class_id=class_id).count()
+
+
+def test_concurrent_reservations_fill_the_section_exactly(app):
+    with app.app_context():
+        class_id = add_class('Rush 101', max_seats=MAX_SEATS)
+        student_ids = add_students(STUDENTS)
+
+    def reserve(student_id):
+        with app.app_context():
+            return school.reserve_seat(student_id, class_id)
+
+    results = Counter(run_concurrently(student_ids, reserve))
+
+    assert results == {'enrolled': MAX_SEATS, 'full': STUDENTS - MAX_SEATS}
+    with app.app_context():
+        assert enrolled_in(class_id) == MAX_SEATS
+        assert school.catalog.get(class_id)['student_count'] == MAX_SEATS
+        # a second try is turned away, not added
+        assert school.reserve_seat(student_ids[0], class_id) in ('already_enrolled', 'full')
+        assert enrolled_in(class_id) == MAX_SEATS
+
+
+def test_concurrent_enroll_requests_in_strict_mode(make_app):
+    # a request over the query budget raises instead of logging
+    app = make_app(SQL_STRICT=True, SQL_QUERY_BUDGET=ENROLL_QUERY_BUDGET)
+    with app.app_context():
+        class_id = add_class('Rush 102', max_seats=MAX_SEATS)
+        student_ids = add_students(STUDENTS)
+
+    def enroll(student_id):
+        client = app.test_client()
+        sign_in_as(client, student_id)
+        response = client.get(f'/enroll/{class_id}')
+        assert response.status_code == 302
+        assert '/student-add-courses' in response.location
+        # only a refusal is flashed
+        with client.session_transaction() as sess:
+            return [message for _, message in sess.get('_flashes', [])]
+
+    messages = Counter(tuple(flashed) for flashed in run_concurrently(student_ids, enroll))
+
+    assert messages == {(): MAX_SEATS,
+                        (school.REGISTRATION_MESSAGES['full'],): STUDENTS - MAX_SEATS}
+    with app.app_context():
+        assert enrolled_in(class_id) == MAX_SEATS
+
+
+def test_concurrent_queued_enrolls_get_one_ticket_each(make_app):
+    app = make_app(REGISTRATION_MODE='queued')
+    with app.app_context():
+        class_id = add_class('Rush 103', max_seats=MAX_SEATS)
+        student_ids = add_students(STUDENTS)
+
+    def enroll(student_id):
+        client = app.test_client()
+        sign_in_as(client, student_id)
+        response = client.get(f'/enroll/{class_id}', headers={'Accept': 'application/json'})
+        assert response.status_code == 202
+        return student_id, response.json['ticket']
+
+    try:
+        tickets = dict(run_concurrently(student_ids, enroll))
+        assert len(set(tickets.values())) == STUDENTS
+        with app.app_context():
+            deadline = time.monotonic() + 30
+            while school.RegistrationRequest.query.filter_by(status='pending').count():
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+            stored = dict(school.db.session.query(school.RegistrationRequest.id,
+                                                  school.RegistrationRequest.student_id))
+            results = Counter(result for (result,) in
+                              school.db.session.query(school.RegistrationRequest.result))
+            assert enrolled_in(class_id) == MAX_SEATS
+    finally:
+        school.registration_workers.stop()
+
+    # each ticket is the request of the student it was handed to
+    assert {ticket: student_id for student_id, ticket in tickets.items()} == stored
+    assert results == {'enrolled': MAX_SEATS, 'full': STUDENTS - MAX_SEATS}
@@ -0,0 +1,138 @@
+import logging
+import re
+
+import pytest
+from sqlalchemy import event, select, text
+from sqlalchemy.exc import OperationalError
+
+import app as school
+import instrumentation
+from conftest import add_class, add_students, sign_in_as
+
+
+def server_timing(response):
+    # {'db': (milliseconds, description), 'app': (milliseconds, None)}
+    timings = {}
+    for value in response.headers.getlist('Server-Timing'):
+        name, *params = value.split(';')
+        params = dict(param.split('=', 1) for param in params)
+        timings[name] = (float(params['dur']), params.get('desc', '').strip('"') or None)
+    return timings
+
+
+@pytest.fixture
+def counted(app):
+    # statements the engine ran while the test's requests were served
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = school.db.engine
+    event.listen(engine, 'after_cursor_execute', count)
+    yield statements
+    event.remove(engine, 'after_cursor_execute', count)
+
+
+def test_server_timing_counts_the_request_queries(app, counted):
+    with app.app_context():
+        add_class('Algebra')
+    counted.clear()
+
+    response = app.test_client().get('/courses/search?q=Algebra')
+
+    assert response.status_code == 200
+    timings = server_timing(response)
+    db_time, description = timings['db']
+    assert description == f'{len(counted)} queries'
+    assert len(counted) > 0
+    assert 0 <= db_time <= timings['app'][0]
+
+
+def test_repeated_select_is_reported_as_n_plus_one(app, caplog):
+    def lookups():
+        for user_id in range(3):
+            school.db.session.execute(select(school.User).where(school.User.id == user_id)).all()
+        return 'ok'
+    app.add_url_rule('/lookups', 'lookups', lookups)
+
+    with caplog.at_level(logging.WARNING, logger=app.logger.name):
+        app.test_client().get('/lookups')
+
+    assert any('GET /lookups (lookups): suspected N+1, ran 3 times: SELECT' in message
+               for message in caplog.messages)
+    body = app.test_client().get('/metrics').get_data(as_text=True)
+    assert 'db_n_plus_one_requests_total{endpoint="lookups"} 1' in body
+
+
+def test_student_courses_page_has_no_n_plus_one(app, caplog):
+    with app.app_context():
+        class_ids = [add_class(f'Course {i}', time=f'MW {8 + i}:00-{8 + i}:50 AM')
+                     for i in range(4)]
+        (student_id,) = add_students(1)
+        for class_id in class_ids:
+            assert school.reserve_seat(student_id, class_id) == 'enrolled'
+    client = app.test_client()
+    sign_in_as(client, student_id)
+
+    with caplog.at_level(logging.WARNING, logger=app.logger.name):
+        response = client.get('/student-view-courses')
+
+    assert response.status_code == 200
+    for i in range(4):
+        assert f'Course {i}' in response.get_data(as_text=True)
+    assert not [message for message in caplog.messages if 'N+1' in message]
+
+
+def test_metrics_are_prometheus_histograms(app):
+    client = app.test_client()
+    for _ in range(3):
+        client.get('/courses/search?q=x')
+    client.get('/metrics')
+
+    response = client.get('/metrics')
+
+    assert response.mimetype == 'text/plain'
+    assert response.headers['Content-Type'].endswith('version=0.0.4; charset=utf-8')
+    lines = response.get_data(as_text=True).splitlines()
+    for name in ('http_request_duration_seconds', 'db_time_per_request_seconds',
+                 'db_queries_per_request'):
+        assert f'# TYPE {name} histogram' in lines
+        label = 'endpoint="main.course_search"'
+        buckets = [line for line in lines if line.startswith(f'{name}_bucket{{{label},')]
+        counts = [int(line.rsplit(' ', 1)[1]) for line in buckets]
+        assert counts == sorted(counts)
+        assert buckets[-1] == f'{name}_bucket{{{label},le="+Inf"}} 3'
+        assert f'{name}_count{{{label}}} 3' in lines
+        assert re.search(rf'^{name}_sum{{{label}}} \d+\.\d{{6}}$', '\n'.join(lines), re.M)
+    # the scrape itself is left out
+    assert 'endpoint="metrics"' not in response.get_data(as_text=True)
+
+
+def test_failed_statement_leaves_no_start_time_behind(app):
+    def fails():
+        with pytest.raises(OperationalError):
+            school.db.session.execute(text('SELECT * FROM no_such_table'))
+        school.db.session.rollback()
+        school.db.session.execute(text('SELECT 1'))
+        return {'starts': school.db.session.connection().info.get('query_start')}
+    app.add_url_rule('/fails', 'fails', fails)
+
+    response = app.test_client().get('/fails')
+
+    assert response.json == {'starts': []}
+    # only the statement that ran is counted
+    assert server_timing(response)['db'][1] == '1 queries'
+
+
+def test_strict_mode_raises_over_budget(make_app, caplog):
+    app = make_app(SQL_QUERY_BUDGET=0, SQL_STRICT=True)
+    with pytest.raises(instrumentation.QueryBudgetExceeded, match='budget is 0'):
+        app.test_client().get('/courses/search?q=x')
+
+    app = make_app(SQL_QUERY_BUDGET=0)
+    with caplog.at_level(logging.WARNING, logger=app.logger.name):
+        response = app.test_client().get('/courses/search?q=x')
+    assert response.status_code == 200
+    assert any('budget is 0' in message for message in caplog.messages)
@@ -0,0 +1,66 @@
+from contextlib import contextmanager
+from unittest import mock
+
+import app as school
+from conftest import add_class
+
+
+class Worker:
+    # an app with its own catalog cache, the way each worker process of a
+    # prefork server has one
+    def __init__(self, app):
+        self.app = app
+        self.client = app.test_client()
+        self.catalog = school.CatalogCache()
+
+    @contextmanager
+    def serving(self):
+        with mock.patch.object(school, 'catalog', self.catalog):
+            yield self.client
+
+
+def seat_count(client, name):
+    (row,) = client.get(f'/courses/search?q={name}').json['results']
+    return row['student_count']
+
+
+def test_workers_share_sessions_and_catalog(make_app):
+    first, second = Worker(make_app()), Worker(make_app())
+    with first.app.app_context():
+        class_id = add_class('Geology', max_seats=5)
+
+    with first.serving() as client:
+        client.post('/student-registration', data={'uni_id': 'rock', 'password': 'pass'})
+        response = client.post('/student-login', data={'username': 'rock', 'password': 'pass'})
+        assert response.status_code == 302
+        cookie = client.get_cookie('session')
+
+    # the session the first worker signed is good on the second
+    second.client.set_cookie('session', cookie.value)
+    with second.serving() as client, second.app.app_context():
+        assert client.get('/student-view-courses').status_code == 200
+        assert seat_count(client, 'Geology') == 0
+
+        # enroll through the first worker
+        with first.serving() as other:
+            response = other.get(f'/enroll/{class_id}')
+            assert '/student-add-courses' in response.location
+
+        # a request under an app context that is still pushed has to
+        # pick up the change too
+        assert seat_count(client, 'Geology') == 1
+        assert 'Geology' in client.get('/student-view-courses').get_data(as_text=True)
+
+
+def test_workers_with_another_key_reject_the_session(make_app, tmp_path):
+    first = make_app()
+    second = make_app(SECRET_KEY_FILE=str(tmp_path / 'other_key'))
+    client = first.test_client()
+    client.post('/student-registration', data={'uni_id': 'rock', 'password': 'pass'})
+    client.post('/student-login', data={'username': 'rock', 'password': 'pass'})
+
+    other = second.test_client()
+    other.set_cookie('session', client.get_cookie('session').value)
+    response = other.get('/student-view-courses')
+    assert response.status_code == 302
+    assert '/student-login' in response.location
@@ -0,0 +1,16 @@
+# WSGI entry point for running several worker processes
+#
+#   export SECRET_KEY=...                    # or SECRET_KEY_FILE, shared by all workers
+#   export DATABASE_URL=sqlite:////srv/school/school.db
+#   flask --app app upgrade-db               # once, before the workers start
+#   gunicorn --workers 4 --threads 4 --bind 0.0.0.0:8000 wsgi:app
+#
+# every worker builds its own app and engine pool from the same
+# environment. Sessions work across workers because they share the
+# secret, and SQLite in WAL mode lets their readers run alongside the
+# single writer. Any WSGI server that imports wsgi:app works the same
+# way (uwsgi --module wsgi:app, waitress-serve wsgi:app).
+
+from app import create_app
+
+app = create_app()